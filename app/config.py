@@ -5,25 +5,133 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# any OpenAI-compatible endpoint, e.g. a local fake LLM server for load tests
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+# model for test case generation; gemini-* routes to Gemini, stub* to the offline stub
+TESTCASE_MODEL = os.getenv("TESTCASE_MODEL", "") or OPENAI_MODEL
+# process-wide cap on in-flight calls per provider, across all jobs
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+# simulated latency of the "stub" provider
+LLM_STUB_LATENCY_MS = int(os.getenv("LLM_STUB_LATENCY_MS", "200"))
+# provider rate limits per model, shared by all jobs (services/rate_limit.py); 0 = unlimited.
+# LLM_RATE_LIMITS overrides them per model as JSON: {"gpt-4o": {"rpm": 500, "tpm": 30000}}
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "500"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "200000"))
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+# the limits above are account-wide; each server process takes an equal share
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+# consecutive failed calls that open a provider's circuit, and seconds it stays open
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+# max diff chunks reviewed in parallel per PR
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+# cosine similarity at which two findings count as near-duplicates (utils/finding_dedup.py)
+FINDING_SIMILARITY_THRESHOLD = float(os.getenv("FINDING_SIMILARITY_THRESHOLD", "0.75"))
+# findings are merged in batches of at most this many tokens before the final summary call
+CONSOLIDATION_BATCH_TOKENS = int(os.getenv("CONSOLIDATION_BATCH_TOKENS", "6000"))
 
 BITBUCKET_USER = os.getenv("BITBUCKET_USER", "")
 BITBUCKET_TOKEN = os.getenv("BITBUCKET_TOKEN", "")
 BITBUCKET_WORKSPACE = os.getenv("BITBUCKET_WORKSPACE", "")
+# upstream base URLs; overridden to point at local stand-ins (benchmarks/stub_servers.py)
+BITBUCKET_API_BASE = os.getenv("BITBUCKET_API_BASE", "https://api.bitbucket.org/2.0").rstrip("/")
+# inline comment posting: parallel requests and sustained rate (Bitbucket allows ~1000 API calls/hour)
+BITBUCKET_COMMENT_CONCURRENCY = int(os.getenv("BITBUCKET_COMMENT_CONCURRENCY", "4"))
+BITBUCKET_COMMENTS_PER_MINUTE = float(os.getenv("BITBUCKET_COMMENTS_PER_MINUTE", "60"))
 
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", "")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 SES_SENDER = os.getenv("SES_SENDER", "")
+SES_ENDPOINT_URL = os.getenv("SES_ENDPOINT_URL", "")
+# "ses", or "smtp" to deliver to a local SMTP sink at SMTP_HOST:SMTP_PORT
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "ses").lower()
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+# emails per second (SES sending quota; 1 in the SES sandbox)
+SES_MAX_SEND_RATE = float(os.getenv("SES_MAX_SEND_RATE", "1"))
+EMAIL_QUEUE_MAXSIZE = int(os.getenv("EMAIL_QUEUE_MAXSIZE", "1000"))
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "5"))
 DEFAULT_RECIPIENT_EMAIL = os.getenv("DEFAULT_RECIPIENT_EMAIL", "")
 
+# review only the commits pushed since the last reviewed revision on pullrequest:updated
+INCREMENTAL_REVIEW = os.getenv("INCREMENTAL_REVIEW", "true").lower() == "true"
+
 POST_PR_COMMENT = os.getenv("POST_PR_COMMENT", "true").lower() == "true"
+# edit the bot's existing review comment on a PR instead of adding a new one per revision
+UPDATE_PR_COMMENT = os.getenv("UPDATE_PR_COMMENT", "true").lower() == "true"
+# post line-anchored findings as inline comments; the summary comment then only counts them
+POST_INLINE_COMMENTS = os.getenv("POST_INLINE_COMMENTS", "true").lower() == "true"
+# inline comments per review; the rest are listed in the summary comment
+MAX_INLINE_COMMENTS = int(os.getenv("MAX_INLINE_COMMENTS", "50"))
 SEND_EMAIL = os.getenv("SEND_EMAIL", "true").lower() == "true"
 
 NOTION_TESTCASES_DB_ID = os.getenv("NOTION_TESTCASES_DB_ID", "")
 NOTION_BACKLOG_DB_ID = os.getenv("NOTION_BACKLOG_DB_ID", "")
 NOTION_API_KEY = os.getenv("NOTION_API_KEY", "")
+NOTION_API_BASE = os.getenv("NOTION_API_BASE", "https://api.notion.com/v1").rstrip("/")
+# unique-ID property holding the epic number in the backlog database
+NOTION_EPIC_ID_PROPERTY = os.getenv("NOTION_EPIC_ID_PROPERTY", "04")
+# min seconds between incremental refreshes of the local epic index
+NOTION_INDEX_REFRESH_SECONDS = int(os.getenv("NOTION_INDEX_REFRESH_SECONDS", "300"))
+# concurrent Notion requests and the sustained request rate (Notion allows ~3/s per integration)
+NOTION_CONCURRENCY = int(os.getenv("NOTION_CONCURRENCY", "3"))
+NOTION_REQUESTS_PER_SECOND = float(os.getenv("NOTION_REQUESTS_PER_SECOND", "3"))
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
 
-# heuristic for chunking long diffs (characters per chunk)
-MAX_TOKENS_PER_CHUNK = int(os.getenv("MAX_TOKENS_PER_CHUNK", "8000"))
+# hard cap on diff bytes read per review; the rest is reported as truncated
+MAX_DIFF_BYTES = int(os.getenv("MAX_DIFF_BYTES", str(20 * 1024 * 1024)))
+
+# files dropped before review (comma-separated globs; "regex:<expr>" for regexes)
+DIFF_EXCLUDE_PATTERNS = [p.strip() for p in (
+    os.getenv("DIFF_EXCLUDE_PATTERNS")
+    or "*.lock,package-lock.json,pnpm-lock.yaml,go.sum,*.min.js,*.min.css,*.map,*.bundle.js,"
+    "*_pb2.py,*_pb2_grpc.py,*.pb.go,*.pb.cc,*.pb.h,*.g.dart,*.snap,__snapshots__/*,"
+    "vendor/*,node_modules/*,dist/*,*.png,*.jpg,*.jpeg,*.gif,*.ico,*.pdf,*.woff,*.woff2,*.ttf"
+).split(",") if p.strip()]
+# per-repo overrides as JSON, e.g. {"my-repo": {"exclude": ["migrations/*"], "include": ["vendor/ours/*"]}}
+DIFF_FILTER_RULES = os.getenv("DIFF_FILTER_RULES", "")
+MAX_FILE_DIFF_BYTES = int(os.getenv("MAX_FILE_DIFF_BYTES", str(512 * 1024)))
+# total diff tokens reviewed per PR, highest-priority files first (0 = no limit)
+REVIEW_TOKEN_BUDGET = int(os.getenv("REVIEW_TOKEN_BUDGET", "0"))
+
+# chunk budgeting: fill each LLM request up to this share of the model's
+# context window (see utils/tokens.py); MAX_TOKENS_PER_CHUNK optionally caps it
+CHUNK_CONTEXT_SHARE = float(os.getenv("CHUNK_CONTEXT_SHARE", "0.5"))
+MAX_TOKENS_PER_CHUNK = int(os.getenv("MAX_TOKENS_PER_CHUNK") or "0")
+
+# local state (job records, caches, dedup keys) lives in this SQLite file
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "data/reviewer.db")
+
+# background review jobs
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")  # memory | sqlite | redis
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_MAXSIZE = int(os.getenv("JOB_QUEUE_MAXSIZE", "100"))
+# times a job is put back in the queue while the LLM provider is unavailable
+JOB_MAX_DEFERRALS = int(os.getenv("JOB_MAX_DEFERRALS", "5"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# per-chunk review cache (content-addressed, see services/review_cache.py)
+REVIEW_CACHE_SIZE = int(os.getenv("REVIEW_CACHE_SIZE", "2048"))
+REVIEW_CACHE_TTL = int(os.getenv("REVIEW_CACHE_TTL", str(7 * 24 * 3600)))
+REVIEW_CACHE_DISK = os.getenv("REVIEW_CACHE_DISK", "true").lower() == "true"
+REVIEW_CACHE_DISK_MAX_ENTRIES = int(os.getenv("REVIEW_CACHE_DISK_MAX_ENTRIES", "50000"))
+
+# webhook dedup keys shared across workers (services/dedup.py)
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "sqlite")  # sqlite | redis
+# how long an in-flight claim blocks redeliveries before a crashed job's key frees up
+DEDUP_LEASE_SECONDS = int(os.getenv("DEDUP_LEASE_SECONDS", "1800"))
+# how long a finished PR revision / merged epic keeps dropping redeliveries
+PR_DEDUP_TTL = int(os.getenv("PR_DEDUP_TTL", "600"))
+MERGE_DEDUP_TTL = int(os.getenv("MERGE_DEDUP_TTL", "1000"))
+
+# outbound HTTP (Bitbucket, Notion): pooled sessions, timeouts and retries (utils/http.py)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
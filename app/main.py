@@ -1,27 +1,42 @@
 import json
-from fastapi import FastAPI, Request, Header, HTTPException
-from fastapi.responses import JSONResponse
+from typing import Optional
+from fastapi import FastAPI, Request, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
 import os
-from .config import (
-    POST_PR_COMMENT, SEND_EMAIL, DEFAULT_RECIPIENT_EMAIL, MAX_TOKENS_PER_CHUNK
-)
-from .services.bitbucket import fetch_pr_diff, post_pr_comment
+from .services.bitbucket import fetch_pr_diff
 from .services.notion import save_testcases_to_notion, fetch_epic_from_notion
-from .services.llm import review_diff_chunks,generate_test_cases
+from .services.notion_cache import get_testcase_run, save_testcase_run
+from .services.llm import generate_test_cases
+from .services.jobs import job_queue, QueueFull
+from .services.email_ses import email_dispatcher
+from .services.pipeline import run_pr_review, drop_pr_review
 from .services.review_formatter import format_review
-from .services.email_ses import send_email_ses
-from .utils.chunker import chunk_text
+from .services.review_cache import review_cache
+from .services.dedup import dedup_store, IN_FLIGHT
+from .services.review_state import set_latest_revision
+from .services import review_store
+from .services import rate_limit
+from .config import DEDUP_LEASE_SECONDS, MERGE_DEDUP_TTL
 from .utils.logger import logger
+from .utils import http, metrics
 import time
 import asyncio
 import re
 
-processed_prs = set()  # ideally, use a persistent cache like Redis
+app = FastAPI(title="Bitbucket AI Code Reviewer")
+job_queue.register("pr_review", run_pr_review, on_drop=drop_pr_review)
 
-processed_mrs = set()  # ideally, use a persistent cache like Redis
 
+@app.on_event("startup")
+async def startup():
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_queue.stop()
+    await asyncio.to_thread(email_dispatcher.stop)
 
-app = FastAPI(title="Bitbucket AI Code Reviewer")
 
 @app.get("/health")
 def health():
@@ -30,7 +45,8 @@ def health():
 @app.post("/webhooks/bitbucket")
 async def handle_bitbucket(request: Request, x_event_key: str = Header(None)):
     try:
-        payload = await request.json()
+        with metrics.span("webhook_parse"):
+            payload = await request.json()
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
@@ -45,56 +61,104 @@ async def handle_bitbucket(request: Request, x_event_key: str = Header(None)):
         diff_url = pr["links"]["diff"]["href"]
         author_display = pr["author"]["display_name"]
         author_email = author_display+"@greatmanagerinstitute.com"
+        head_commit = ((pr.get("source") or {}).get("commit") or {}).get("hash")
 
-        key = f"{repo_slug}-{pr_id}"
-        if key in processed_prs:
-            return {"status": "ignored", "reason": "already processed."}
-
-        processed_prs.add(key)
-        # schedule removal after 10 min
-        asyncio.create_task(remove_after_delay(key, 600))
+        key = f"pr:{repo_slug}:{pr_id}:{head_commit or 'unknown'}"
+        if not await asyncio.to_thread(dedup_store.acquire, key, DEDUP_LEASE_SECONDS):
+            return {"status": "ignored", "reason": await asyncio.to_thread(_dedup_reason, key)}
     except KeyError as e:
         logger.error("Missing key in payload: %s", e)
         raise HTTPException(status_code=400, detail=f"Missing key: {e}")
 
     logger.info("Webhook for repo=%s PR#%s by %s", repo_slug, pr_id, author_display)
 
-    # 1) Fetch diff
-    diff = fetch_pr_diff(diff_url)
-
-    # 2) Chunk and review via LLM
-    chunks = chunk_text(diff, MAX_TOKENS_PER_CHUNK)
-    sections = review_diff_chunks(chunks)
-
-    # 3) Format once
-    body_md = format_review(sections)
-
-    # 4) Post PR comment
-    result = None
-    if POST_PR_COMMENT:
-        result = post_pr_comment(repo_slug, pr_id, body_md)
-
-    # 5) Email (optional)
-    if SEND_EMAIL and author_email:
-        html = f"""<h3>Hello {author_display},</h3>
-        <p>Here is the AI-generated review for PR <b>#{pr_id}</b> in <b>{repo_slug}</b>:</p>
-        <pre style="background:#f6f8fa;padding:12px;white-space:pre-wrap">{body_md}</pre>
-        <p><em>This is an automated message.</em></p>
-        """
-        send_email_ses(
-            to_email=author_email,
-            subject=f"AI Code Review: {repo_slug} PR#{pr_id}",
-            html_body=html,
-            text_body=body_md
-        )
-
-
-    return {"status": "ok", "comment_posted": bool(result), "emailed": bool(author_email) and SEND_EMAIL}
+    if head_commit:
+        # supersedes any queued or running review of an older revision of this PR
+        await asyncio.to_thread(set_latest_revision, repo_slug, pr_id, head_commit, pr.get("updated_on") or "")
 
+    try:
+        job_id = await job_queue.submit("pr_review", {
+            "repo_slug": repo_slug,
+            "pr_id": pr_id,
+            "diff_url": diff_url,
+            "head_commit": head_commit,
+            "dedup_key": key,
+            "author_display": author_display,
+            "author_email": author_email,
+        })
+    except QueueFull as e:
+        # let Bitbucket retry later instead of dropping the review
+        await asyncio.to_thread(dedup_store.release, key)
+        logger.warning("Rejecting webhook for %s: %s", key, e)
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return JSONResponse({"status": "queued", "job_id": job_id}, status_code=202)
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/reviews")
+def list_reviews(
+    repo: Optional[str] = None,
+    pr: Optional[int] = None,
+    commit: Optional[str] = None,
+    since: Optional[float] = Query(None, description="epoch seconds, inclusive"),
+    until: Optional[float] = Query(None, description="epoch seconds, exclusive"),
+    cursor: Optional[int] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(20, ge=1, le=100),
+    sections: bool = Query(False, description="include the full review sections"),
+):
+    """Stored reviews, newest first."""
+    items, next_cursor = review_store.list_reviews(
+        repo_slug=repo, pr_id=pr, commit=commit, since=since, until=until,
+        before_id=cursor, limit=limit, with_sections=sections,
+    )
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@app.get("/reviews/{review_id}")
+def get_review(review_id: int, format: str = Query("json", pattern="^(json|markdown)$")):
+    review = review_store.get_review(review_id)
+    if not review:
+        raise HTTPException(status_code=404, detail="Review not found")
+    if format == "markdown":
+        # the comment body as it would be posted, without another LLM call
+        return Response(content=format_review(review["sections"]), media_type="text/markdown")
+    return review
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return review_cache.stats()
+
+
+@app.get("/http/stats")
+def http_stats():
+    return http.latency_stats()
+
+
+@app.get("/llm/stats")
+def llm_stats():
+    return rate_limit.stats()
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+def _dedup_reason(key: str) -> str:
+    if dedup_store.status(key) == IN_FLIGHT:
+        return "already in progress."
+    return "already processed."
 
-async def remove_after_delay(key: str, delay: int = 600):
-    await asyncio.sleep(delay)
-    processed_prs.discard(key)
 
 @app.post("/webhooks/bitbucket-pr-merged")
 async def handle_pr_merge(request: Request):
@@ -118,43 +182,79 @@ async def handle_pr_merge(request: Request):
 
         logger.info("PR merged for repo=%s branch=%s epic=%s", repo_slug, branch_name, epic_no)
 
-        if epic_no in processed_mrs:
-            return {"status": "ignored", "reason": "already processed."}
+        merge_key = f"merge:{epic_no}"
+        if not await asyncio.to_thread(dedup_store.acquire, merge_key, DEDUP_LEASE_SECONDS):
+            return {"status": "ignored", "reason": await asyncio.to_thread(_dedup_reason, merge_key)}
+
+        try:
+            response = await _process_merge(pr, repo_slug, epic_no)
+        except Exception:
+            # let a redelivery of this webhook try again
+            await asyncio.to_thread(dedup_store.release, merge_key)
+            raise
+        failed = isinstance(response, dict) and response.get("testcases_stored", {}).get("failed")
+        if failed or getattr(response, "status_code", 200) >= 500:
+            # a redelivery generates again or writes only the missing cases;
+            # stored ones are skipped by idempotency key
+            await asyncio.to_thread(dedup_store.release, merge_key)
+        else:
+            await asyncio.to_thread(dedup_store.complete, merge_key, MERGE_DEDUP_TTL)
+        return response
+
+    except Exception as e:
+        logger.error("Error in PR merge handler: %s", str(e), exc_info=True)
+        return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
-        processed_mrs.add(epic_no)
-        # schedule removal after 10 min
-        asyncio.create_task(remove_after_delay(epic_no, 1000))
 
-        # --- 1. Fetch Epic details from Notion ---
-        epic_details = fetch_epic_from_notion(epic_no)
+async def _process_merge(pr: dict, repo_slug: str, epic_no: str):
+    # --- 1. Fetch Epic details from Notion ---
+    epic_details = await fetch_epic_from_notion(epic_no)
 
-        page_id = (epic_details or {}).get("epicPageId", None)
-        
-        if not page_id:
-            logger.warning("No Notion page ID found for Epic: %s", epic_no)
-            return JSONResponse({"status": "ignored", "reason": "no notion page id found"})
+    page_id = (epic_details or {}).get("epicPageId", None)
+    
+    if not page_id:
+        logger.warning("No Notion page ID found for Epic: %s", epic_no)
+        return JSONResponse({"status": "ignored", "reason": "no notion page id found"})
 
-        if not epic_details:
-            logger.warning("No details found in Notion for Epic: %s", epic_no)
-            return JSONResponse({"status": "ignored", "reason": "no epic details found"})
-        epic_name = (epic_details or {}).get("Epic Name", "N/A")
+    if not epic_details:
+        logger.warning("No details found in Notion for Epic: %s", epic_no)
+        return JSONResponse({"status": "ignored", "reason": "no epic details found"})
+    epic_name = (epic_details or {}).get("Epic Name", "N/A")
 
 
+    # --- 2. Generate Test Cases via LLM, once per merge ---
+    # a redelivery after a partial failure reuses the same cases, so their
+    # idempotency keys match and only the missing ones are written
+    merge_commit = (pr.get("merge_commit") or {}).get("hash") or ""
+    run_key = f"{epic_no}:{repo_slug}#{pr['id']}@{merge_commit}"
+    testcases = await asyncio.to_thread(get_testcase_run, run_key)
+    if testcases is None:
         pr_title = pr.get("title") or ""
         pr_desc = pr.get("description") or ""
-        diff = fetch_pr_diff(pr["links"]["diff"]["href"]) or ""
+        with metrics.span("diff_fetch"):
+            diff = await asyncio.to_thread(fetch_pr_diff, pr["links"]["diff"]["href"]) or ""
 
-        # --- 2. Generate Test Cases via LLM ---
         combined_context = f"{pr_title}\n\n{pr_desc}\n\n{diff}"
-        testcases = generate_test_cases(epic_no, epic_name, epic_details['PRD'], combined_context)
-
-        print(testcases,'testcases')
-
-        # --- 3. Store in Notion Test Cases DB ---
-        save_testcases_to_notion(page_id, testcases)
-
-        return {"status": "ok", "epic": epic_no, "testcases_stored": ''}
-
-    except Exception as e:
-        logger.error("Error in PR merge handler: %s", str(e), exc_info=True)
-        return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
\ No newline at end of file
+        with metrics.span("testcase_generation"):
+            testcases = await generate_test_cases(epic_no, epic_name, epic_details['PRD'], combined_context)
+        if testcases is None:
+            # nothing is stored, so a redelivery generates again
+            return JSONResponse({"status": "error", "reason": "test case generation failed"}, status_code=502)
+        logger.info("Generated %d test cases for %s", len(testcases), epic_no)
+        await asyncio.to_thread(save_testcase_run, run_key, testcases)
+    else:
+        logger.info("Reusing %d test cases generated earlier for %s", len(testcases), run_key)
+
+    # --- 3. Store in Notion Test Cases DB ---
+    results = await save_testcases_to_notion(page_id, testcases, run_key)
+
+    return {
+        "status": "ok",
+        "epic": epic_no,
+        "testcases_stored": {
+            "created": sum(r["status"] == "created" for r in results),
+            "already_present": sum(r["status"] == "exists" for r in results),
+            "failed": sum(r["status"] == "failed" for r in results),
+            "results": results,
+        },
+    }
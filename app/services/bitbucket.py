@@ -1,35 +1,266 @@
-from typing import Optional
+import asyncio
+import codecs
+import hashlib
+import json
+import threading
+from typing import Iterator, List, Optional
 import requests
+from ..utils import http
 from . import review_formatter
+from .review_state import get_pr_comment, save_pr_comment, get_inline_comment, save_inline_comment
+from .rate_limit import ModelLimiter
 from ..utils.logger import logger
-from ..config import BITBUCKET_USER, BITBUCKET_TOKEN, BITBUCKET_WORKSPACE
+from ..config import (
+    BITBUCKET_USER, BITBUCKET_TOKEN, BITBUCKET_WORKSPACE, BITBUCKET_API_BASE, MAX_DIFF_BYTES,
+    BITBUCKET_COMMENT_CONCURRENCY, BITBUCKET_COMMENTS_PER_MINUTE,
+)
 
-API_BASE = "https://api.bitbucket.org/2.0"
+API_BASE = BITBUCKET_API_BASE
+# only what _find_bot_comment() needs from each comment, to keep lookup pages small
+COMMENT_FIELDS = "next,values.id,values.user.uuid,values.inline,values.parent.id,values.deleted,values.content.raw"
 
-def fetch_pr_diff(diff_url: str) -> str:
-    logger.info("Fetching diff from Bitbucket: %s", diff_url)
-    resp = requests.get(diff_url, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
-    resp.raise_for_status()
-    return resp.text
+_bot_uuid: Optional[str] = None
+_bot_uuid_lock = threading.Lock()
+# shared by all reviews in this process, like the Notion limiter
+_comment_limiter = ModelLimiter(rpm=BITBUCKET_COMMENTS_PER_MINUTE, tpm=0, burst=BITBUCKET_COMMENT_CONCURRENCY)
+_comment_semaphore: Optional[asyncio.Semaphore] = None
+
+class DiffStream:
+    """
+    Iterates the decoded lines of a streamed diff response without buffering
+    the body. Reading stops after `max_bytes`; the partial last line is
+    dropped and `truncated` is set so callers can report it.
+    """
+
+    CHUNK_BYTES = 64 * 1024
+
+    def __init__(self, resp: requests.Response, max_bytes: int = MAX_DIFF_BYTES):
+        self._resp = resp
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.truncated = False
+
+    def __iter__(self) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder(self._resp.encoding or "utf-8")(errors="replace")
+        pending = ""
+        try:
+            for block in self._resp.iter_content(self.CHUNK_BYTES):
+                if self.max_bytes and self.bytes_read + len(block) > self.max_bytes:
+                    block = block[:self.max_bytes - self.bytes_read]
+                    self.truncated = True
+                self.bytes_read += len(block)
+                text = pending + decoder.decode(block)
+                start = 0
+                while True:
+                    end = text.find("\n", start)
+                    if end == -1:
+                        break
+                    yield text[start:end + 1]
+                    start = end + 1
+                pending = text[start:]
+                if self.truncated:
+                    logger.warning("Diff truncated after %d bytes", self.bytes_read)
+                    return
+            pending += decoder.decode(b"", final=True)
+            if pending:
+                yield pending
+        finally:
+            self._resp.close()
+
+
+def _open_diff(url: str, params: Optional[dict] = None, max_bytes: int = MAX_DIFF_BYTES) -> DiffStream:
+    resp = http.get(url, params=params, auth=(BITBUCKET_USER, BITBUCKET_TOKEN), stream=True)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError:
+        resp.close()
+        raise
+    return DiffStream(resp, max_bytes)
+
+def stream_pr_diff(diff_url: str, max_bytes: int = MAX_DIFF_BYTES) -> DiffStream:
+    logger.info("Streaming diff from Bitbucket: %s", diff_url)
+    return _open_diff(diff_url, max_bytes=max_bytes)
+
+def stream_commit_diff(repo_slug: str, new_commit: str, old_commit: str, max_bytes: int = MAX_DIFF_BYTES) -> DiffStream:
+    """Plain two-dot diff from old_commit to new_commit (the PR interdiff between two pushes)."""
+    url = f"{API_BASE}/repositories/{BITBUCKET_WORKSPACE}/{repo_slug}/diff/{new_commit}..{old_commit}"
+    logger.info("Streaming interdiff %s..%s for %s", old_commit, new_commit, repo_slug)
+    return _open_diff(url, params={"topic": "false"}, max_bytes=max_bytes)
+
+def fetch_pr_diff(diff_url: str, max_bytes: int = MAX_DIFF_BYTES) -> str:
+    return "".join(stream_pr_diff(diff_url, max_bytes))
+
+def _comments_url(repo_slug: str, pr_id: int) -> str:
+    return f"{API_BASE}/repositories/{BITBUCKET_WORKSPACE}/{repo_slug}/pullrequests/{pr_id}/comments"
 
 def post_pr_comment(repo_slug: str, pr_id: int, body: str) -> Optional[dict]:
-    url = f"{API_BASE}/repositories/{BITBUCKET_WORKSPACE}/{repo_slug}/pullrequests/{pr_id}/comments"
+    url = _comments_url(repo_slug, pr_id)
     payload = { "content": { "raw": body } }
     logger.info("Posting PR comment to %s PR#%s", repo_slug, pr_id)
-    resp = requests.post(url, json=payload, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
+    resp = http.post(url, json=payload, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
     if resp.status_code not in (200, 201):
         logger.error("Failed to post comment: %s - %s", resp.status_code, resp.text)
         return None
     return resp.json()
 
+def body_hash(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def bot_uuid() -> Optional[str]:
+    """
+    uuid of the account the bot posts as; looked up once. None if the token
+    may not read it (no `account` scope). Raises on 5xx and connection errors.
+    """
+    global _bot_uuid
+    with _bot_uuid_lock:
+        if _bot_uuid is None:
+            resp = http.get(f"{API_BASE}/user", params={"fields": "uuid"}, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
+            if 400 <= resp.status_code < 500:
+                logger.warning("Bitbucket /user returned %s; existing review comments cannot be looked up", resp.status_code)
+                _bot_uuid = ""
+            else:
+                resp.raise_for_status()
+                _bot_uuid = resp.json().get("uuid") or ""
+        return _bot_uuid or None
+
+def _find_bot_comment(repo_slug: str, pr_id: int) -> Optional[dict]:
+    """
+    Newest top-level, non-inline comment the bot account left on a PR, by
+    paging through the PR's comments. Used when no comment id is stored.
+    None if there is none or the bot account is unknown.
+    """
+    uuid = bot_uuid()
+    if not uuid:
+        return None
+    url, params = _comments_url(repo_slug, pr_id), {"pagelen": 100, "fields": COMMENT_FIELDS}
+    found = None
+    while url:
+        resp = http.get(url, params=params, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
+        resp.raise_for_status()
+        data = resp.json()
+        for comment in data.get("values", []):
+            if ((comment.get("user") or {}).get("uuid") == uuid and not comment.get("deleted")
+                    and not comment.get("inline") and not comment.get("parent")):
+                if found is None or comment["id"] > found["id"]:
+                    found = comment
+        # `next` already carries the query string
+        url, params = data.get("next"), None
+    return found
+
+def _put_pr_comment(repo_slug: str, pr_id: int, comment_id: int, body: str) -> Optional[dict]:
+    url = f"{_comments_url(repo_slug, pr_id)}/{comment_id}"
+    resp = http.put(url, json={"content": {"raw": body}}, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return resp.json()
+
+def upsert_pr_comment(repo_slug: str, pr_id: int, body: str) -> Optional[dict]:
+    """
+    Keep one review comment per PR: edit the bot's existing comment in place,
+    or post a new one only if there is none (or it was deleted). Nothing is
+    sent when the body is unchanged. Returns {"id", "action"} with action
+    created/updated/unchanged, or None if posting failed. A failed edit is not
+    answered with a second comment; the stored id is kept. If the token may
+    not look up existing comments (4xx), a new one is posted; 5xx and
+    connection errors during the lookup are raised so the review is retried.
+    """
+    digest = body_hash(body)
+    stored = get_pr_comment(repo_slug, pr_id)
+    if stored and stored["body_hash"] == digest:
+        logger.info("Review comment on %s PR#%s unchanged; skipping update", repo_slug, pr_id)
+        return {"id": stored["id"], "action": "unchanged"}
+
+    if stored:
+        existing = {"id": stored["id"]}
+    else:
+        try:
+            existing = _find_bot_comment(repo_slug, pr_id)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code >= 500:
+                raise
+            logger.warning("Could not list comments on %s PR#%s (%s); posting a new one",
+                           repo_slug, pr_id, e.response.status_code)
+            existing = None
+        if existing and existing.get("content", {}).get("raw") is not None:
+            if body_hash(existing["content"]["raw"]) == digest:
+                save_pr_comment(repo_slug, pr_id, existing["id"], digest)
+                return {"id": existing["id"], "action": "unchanged"}
+
+    if existing:
+        logger.info("Updating PR comment %s on %s PR#%s", existing["id"], repo_slug, pr_id)
+        try:
+            updated = _put_pr_comment(repo_slug, pr_id, existing["id"], body)
+        except requests.RequestException as e:
+            logger.error("Could not update the review comment on %s PR#%s: %s", repo_slug, pr_id, e)
+            return None
+        if updated is not None:
+            save_pr_comment(repo_slug, pr_id, existing["id"], digest)
+            return {"id": existing["id"], "action": "updated"}
+        logger.info("PR comment %s on %s PR#%s is gone; posting a new one", existing["id"], repo_slug, pr_id)
+
+    created = post_pr_comment(repo_slug, pr_id, body)
+    if not created:
+        return None
+    save_pr_comment(repo_slug, pr_id, created["id"], digest)
+    return {"id": created["id"], "action": "created"}
+
+def inline_comment_key(comment: dict) -> str:
+    """Idempotency key: the same finding on the same line of a PR is posted once."""
+    raw = json.dumps([comment["path"], comment["line"], comment["message"]])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def _post_inline_comment(repo_slug: str, pr_id: int, comment: dict) -> dict:
+    global _comment_semaphore
+    result = dict(comment, status="failed", id=None, error=None)
+    try:
+        key = inline_comment_key(comment)
+        existing = await asyncio.to_thread(get_inline_comment, repo_slug, pr_id, key)
+        if existing:
+            return dict(result, status="exists", id=existing)
+
+        if _comment_semaphore is None:
+            _comment_semaphore = asyncio.Semaphore(BITBUCKET_COMMENT_CONCURRENCY)
+        payload = {"content": {"raw": comment["message"]}, "inline": {"path": comment["path"], "to": comment["line"]}}
+        async with _comment_semaphore:
+            await _comment_limiter.acquire(f"{repo_slug}#{pr_id}", 0)
+            resp = await asyncio.to_thread(
+                http.post, _comments_url(repo_slug, pr_id), json=payload, auth=(BITBUCKET_USER, BITBUCKET_TOKEN)
+            )
+        if resp.status_code not in (200, 201):
+            return dict(result, error=f"{resp.status_code}: {resp.text[:500]}")
+        comment_id = resp.json().get("id")
+        await asyncio.to_thread(save_inline_comment, repo_slug, pr_id, key, comment_id)
+        return dict(result, status="created", id=comment_id)
+    except Exception as e:
+        return dict(result, error=str(e))
+
+async def post_inline_comments(repo_slug: str, pr_id: int, comments: List[dict]) -> List[dict]:
+    """
+    Post {"path", "line", "message"} findings as inline PR comments,
+    concurrently within the shared comment rate limit. Findings already posted
+    on this PR (e.g. by a re-run of the same review) are skipped. Returns each
+    comment with status created|exists|failed, its comment id and any error.
+    """
+    results = await asyncio.gather(*[_post_inline_comment(repo_slug, pr_id, c) for c in comments])
+    failed = [r for r in results if r["status"] == "failed"]
+    for r in failed:
+        logger.error("Failed to post inline comment on %s:%s: %s", r["path"], r["line"], r["error"])
+    logger.info(
+        "Inline comments on %s PR#%s: %d created, %d already present, %d failed",
+        repo_slug, pr_id, sum(r["status"] == "created" for r in results),
+        sum(r["status"] == "exists" for r in results), len(failed),
+    )
+    return list(results)
+
 def test_bitbucket_auth():
     """
     Test Bitbucket authentication using App Password.
     Returns True if authenticated, False otherwise.
     """
-    url = "https://api.bitbucket.org/2.0/user"
+    url = f"{API_BASE}/user"
     try:
-        resp = requests.get(url, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
+        resp = http.get(url, auth=(BITBUCKET_USER, BITBUCKET_TOKEN))
         if resp.status_code == 200:
             user = resp.json()
             print(f"Authenticated as: {user.get('display_name')} ({user.get('uuid')})")
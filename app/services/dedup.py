@@ -0,0 +1,105 @@
+import threading
+import time
+from typing import Optional
+from ..config import DEDUP_BACKEND, REDIS_URL
+from ..utils.db import connect
+
+IN_FLIGHT = "in_flight"
+DONE = "done"
+
+
+class DedupStore:
+    """
+    Webhook dedup keys shared by all workers. A key is first leased as
+    IN_FLIGHT with acquire() and then either marked DONE (kept for a TTL so
+    redeliveries are dropped) or released so a retry can run.
+    """
+
+    def acquire(self, key: str, lease_seconds: int) -> bool:
+        """Atomically claim `key` unless a live entry exists. Returns True if claimed."""
+        raise NotImplementedError
+
+    def complete(self, key: str, ttl: int) -> None:
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        raise NotImplementedError
+
+    def status(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+
+class SQLiteDedupStore(DedupStore):
+    # expired rows are deleted every this many acquire() calls
+    SWEEP_EVERY = 200
+
+    def __init__(self, path: Optional[str] = None):
+        self._conn = connect(path) if path else connect()
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_keys (key TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def acquire(self, key: str, lease_seconds: int) -> bool:
+        now = time.time()
+        with self._lock:
+            # single statement, so the check-and-set is atomic across processes
+            claimed = self._conn.execute(
+                "INSERT INTO dedup_keys (key, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at "
+                "WHERE dedup_keys.expires_at <= ?",
+                (key, IN_FLIGHT, now + lease_seconds, now),
+            ).rowcount == 1
+            self._calls += 1
+            if self._calls % self.SWEEP_EVERY == 0:
+                self._conn.execute("DELETE FROM dedup_keys WHERE expires_at <= ?", (now,))
+        return claimed
+
+    def complete(self, key: str, ttl: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dedup_keys (key, state, expires_at) VALUES (?, ?, ?)",
+                (key, DONE, time.time() + ttl),
+            )
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM dedup_keys WHERE key = ?", (key,))
+
+    def status(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM dedup_keys WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row["state"] if row else None
+
+
+class RedisDedupStore(DedupStore):
+    PREFIX = "ai-reviewer:dedup:"
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis  # optional dependency, only needed for DEDUP_BACKEND=redis
+
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def acquire(self, key: str, lease_seconds: int) -> bool:
+        return bool(self._redis.set(self.PREFIX + key, IN_FLIGHT, nx=True, ex=lease_seconds))
+
+    def complete(self, key: str, ttl: int) -> None:
+        self._redis.set(self.PREFIX + key, DONE, ex=ttl)
+
+    def release(self, key: str) -> None:
+        self._redis.delete(self.PREFIX + key)
+
+    def status(self, key: str) -> Optional[str]:
+        return self._redis.get(self.PREFIX + key)
+
+
+def make_dedup_store(name: str = DEDUP_BACKEND) -> DedupStore:
+    if name == "redis":
+        return RedisDedupStore()
+    return SQLiteDedupStore()
+
+
+dedup_store = make_dedup_store()
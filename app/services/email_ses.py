@@ -1,20 +1,42 @@
-import boto3
+import queue
+import random
+import smtplib
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from ..config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, SES_SENDER
+from ..config import (
+    AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, SES_SENDER, SES_ENDPOINT_URL,
+    EMAIL_BACKEND, SMTP_HOST, SMTP_PORT, SES_MAX_SEND_RATE, EMAIL_QUEUE_MAXSIZE, EMAIL_MAX_RETRIES,
+)
 from ..utils.logger import logger
+from ..utils.metrics import span
 
-def send_email_ses(to_email: str, subject: str, html_body: str, text_body: str = None):
-    client = boto3.client(
+SENDER = SES_SENDER or "app@greatmanagerinstitute.com"
+THROTTLE_CODES = {"Throttling", "ThrottlingException", "TooManyRequestsException", "MaxSendingRateExceeded"}
+
+
+@lru_cache(maxsize=1)
+def _ses_client():
+    # built once: credential and endpoint resolution costs tens of ms per client;
+    # boto3 itself is imported here since it adds ~100ms to app startup
+    import boto3
+
+    return boto3.client(
         "ses",
         region_name=AWS_REGION,
         aws_access_key_id=AWS_ACCESS_KEY_ID,
         aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        endpoint_url=SES_ENDPOINT_URL or None,
     )
 
+
+def build_message(to_email: str, subject: str, html_body: str, text_body: str = None) -> MIMEMultipart:
     msg = MIMEMultipart("alternative")
     msg["Subject"] = subject
-    msg["From"] = 'app@greatmanagerinstitute.com'
+    msg["From"] = SENDER
     msg["To"] = to_email
 
     if text_body is None:
@@ -22,10 +44,115 @@ def send_email_ses(to_email: str, subject: str, html_body: str, text_body: str =
 
     msg.attach(MIMEText(text_body, "plain"))
     msg.attach(MIMEText(html_body, "html"))
+    return msg
+
 
-    response = client.send_raw_email(
-        Source='app@greatmanagerinstitute.com',
+def send_email_ses(to_email: str, subject: str, html_body: str, text_body: str = None):
+    """Send one email now, blocking. Webhook paths use email_dispatcher.enqueue() instead."""
+    msg = build_message(to_email, subject, html_body, text_body)
+
+    if EMAIL_BACKEND == "smtp":
+        # local sink, e.g. MailHog or `python -m aiosmtpd -n -l localhost:1025`
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+            smtp.sendmail(SENDER, [to_email], msg.as_string())
+        logger.info("Email sent via SMTP %s:%s to %s", SMTP_HOST, SMTP_PORT, to_email)
+        return
+
+    response = _ses_client().send_raw_email(
+        Source=SENDER,
         Destinations=[to_email],
         RawMessage={"Data": msg.as_string()},
     )
     logger.info("SES email sent: %s", response.get("MessageId"))
+
+
+def _is_throttled(exc: Exception) -> bool:
+    code = (getattr(exc, "response", None) or {}).get("Error", {}).get("Code")
+    return code in THROTTLE_CODES or "maximum sending rate exceeded" in str(exc).lower()
+
+
+class EmailDispatcher:
+    """
+    Queues outgoing emails and sends them from one background thread, at
+    most `rate` per second (the SES sending quota), retrying throttled sends
+    with jittered backoff. enqueue() never blocks the caller.
+    """
+
+    def __init__(
+        self, rate: float = SES_MAX_SEND_RATE, maxsize: int = EMAIL_QUEUE_MAXSIZE,
+        retries: int = EMAIL_MAX_RETRIES, send=send_email_ses,
+    ):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._retries = retries
+        self._send = send
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._next_send = 0.0
+        self.sent = self.failed = 0
+
+    def enqueue(self, to_email: str, subject: str, html_body: str, text_body: str = None) -> bool:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(
+                {"to_email": to_email, "subject": subject, "html_body": html_body, "text_body": text_body}
+            )
+        except queue.Full:
+            logger.error("Email queue is full; dropping email to %s: %s", to_email, subject)
+            return False
+        return True
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Send what is queued (up to `timeout` seconds), then stop the worker."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning("Email dispatcher stopped with %d emails unsent", self._queue.qsize())
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="email-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            self._deliver(message)
+
+    def _wait_for_slot(self) -> None:
+        now = time.monotonic()
+        if self._next_send > now:
+            time.sleep(self._next_send - now)
+        self._next_send = max(now, self._next_send) + self._interval
+
+    def _deliver(self, message: dict) -> None:
+        attempt = 0
+        while True:
+            self._wait_for_slot()
+            try:
+                with span("ses_send"):
+                    self._send(**message)
+                self.sent += 1
+                return
+            except Exception as e:
+                if not _is_throttled(e) or attempt >= self._retries:
+                    self.failed += 1
+                    logger.error("Failed to send email to %s: %s", message["to_email"], str(e))
+                    return
+                delay = random.uniform(0, min(30.0, 2 ** attempt))
+                logger.warning("Email to %s throttled; retry %d/%d in %.1fs", message["to_email"], attempt + 1, self._retries, delay)
+                time.sleep(delay)
+                attempt += 1
+
+
+email_dispatcher = EmailDispatcher()
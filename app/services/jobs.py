@@ -0,0 +1,270 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Set
+from ..config import JOB_BACKEND, JOB_WORKERS, JOB_QUEUE_MAXSIZE, JOB_MAX_DEFERRALS, REDIS_URL
+from ..utils.db import connect
+from ..utils.logger import logger
+from ..utils.metrics import JOBS
+
+JobHandler = Callable[[dict], Awaitable[Optional[dict]]]
+# called with the payload of a job dropped unrun (at shutdown, or a deferred job
+# that no longer fits the queue), e.g. to release its locks
+DropHandler = Callable[[dict], None]
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobDeferred(Exception):
+    """Raised by a handler to run the job again after `delay` seconds instead of failing it."""
+
+    def __init__(self, message: str, delay: float):
+        super().__init__(message)
+        self.delay = delay
+
+
+class JobBackend:
+    """Storage for job records. Subclass and pass to JobQueue to plug in another store."""
+
+    def save(self, job: dict) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+
+class MemoryJobBackend(JobBackend):
+    def __init__(self, max_jobs: int = 1000):
+        self._jobs: Dict[str, dict] = {}
+        self._max_jobs = max_jobs
+        self._lock = threading.Lock()
+
+    def save(self, job: dict) -> None:
+        with self._lock:
+            self._jobs.pop(job["id"], None)
+            self._jobs[job["id"]] = dict(job)
+            # dicts keep insertion order, so the oldest records go first
+            while len(self._jobs) > self._max_jobs:
+                self._jobs.pop(next(iter(self._jobs)))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+class SQLiteJobBackend(JobBackend):
+    def __init__(self, path: Optional[str] = None):
+        self._conn = connect(path) if path else connect()
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def save(self, job: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, data, updated_at) VALUES (?, ?, ?)",
+                (job["id"], json.dumps(job), time.time()),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+
+class RedisJobBackend(JobBackend):
+    def __init__(self, url: str = REDIS_URL, ttl: int = 7 * 24 * 3600):
+        import redis  # optional dependency, only needed for JOB_BACKEND=redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._ttl = ttl
+
+    def save(self, job: dict) -> None:
+        self._redis.set(f"ai-reviewer:job:{job['id']}", json.dumps(job), ex=self._ttl)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raw = self._redis.get(f"ai-reviewer:job:{job_id}")
+        return json.loads(raw) if raw else None
+
+
+def make_backend(name: str = JOB_BACKEND) -> JobBackend:
+    if name == "sqlite":
+        return SQLiteJobBackend()
+    if name == "redis":
+        return RedisJobBackend()
+    return MemoryJobBackend()
+
+
+class JobQueue:
+    """
+    Bounded in-process job queue. Webhook handlers submit() and return at once;
+    a fixed pool of asyncio workers runs the registered handler for each job.
+    """
+
+    def __init__(self, backend: JobBackend, workers: int = JOB_WORKERS, maxsize: int = JOB_QUEUE_MAXSIZE):
+        self.backend = backend
+        self._workers = max(1, workers)
+        self._maxsize = maxsize
+        self._handlers: Dict[str, JobHandler] = {}
+        self._drop_handlers: Dict[str, DropHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        # pending requeue timer of each deferred job -> (job, payload)
+        self._timers: Dict[asyncio.TimerHandle, tuple] = {}
+        # requeues whose timer fired and that are still writing the job record
+        self._requeues: Set[asyncio.Task] = set()
+
+    def register(self, kind: str, handler: JobHandler, on_drop: Optional[DropHandler] = None) -> None:
+        self._handlers[kind] = handler
+        if on_drop:
+            self._drop_handlers[kind] = on_drop
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self._maxsize)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self._workers)]
+        logger.info("Job queue started with %d workers (backend=%s)", self._workers, type(self.backend).__name__)
+
+    async def stop(self) -> None:
+        """
+        Cancel running jobs, then mark queued and deferred jobs cancelled and
+        call their kind's on_drop handler, so no record is left "queued" or
+        "deferred" with nothing left to run it.
+        """
+        dropped = list(self._timers.values())
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        await asyncio.gather(*self._requeues, return_exceptions=True)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            dropped.append(self._queue.get_nowait())
+        for job, payload in dropped:
+            job.update(status="cancelled", error="Server shut down before the job ran", finished_at=time.time())
+            try:
+                await self._save(job)
+                if job["kind"] in self._drop_handlers:
+                    await asyncio.to_thread(self._drop_handlers[job["kind"]], payload)
+            except Exception as e:
+                logger.error("Could not cancel job %s (%s) on shutdown: %s", job["id"], job["kind"], e)
+            JOBS.labels(job["kind"], "cancelled").inc()
+        if dropped:
+            logger.warning("Job queue stopped; %d queued or deferred jobs cancelled", len(dropped))
+
+    async def submit(self, kind: str, payload: dict) -> str:
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+        if self._queue is None:
+            raise RuntimeError("Job queue is not started")
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "deferrals": 0,
+        }
+        if not await self._enqueue(job, payload):
+            raise QueueFull(f"Job queue is full ({self._maxsize} pending)")
+        return job["id"]
+
+    async def _enqueue(self, job: dict, payload: dict) -> bool:
+        """
+        Record the job as queued, then queue it; False if the queue is full.
+        The record is written first so a worker's "running" write always lands after it.
+        """
+        job["status"] = "queued"
+        if self._queue.full():
+            return False
+        await self._save(job)
+        try:
+            self._queue.put_nowait((job, payload))
+        except asyncio.QueueFull:
+            # filled up while the record was written
+            return False
+        return True
+
+    async def _save(self, job: dict) -> None:
+        # the SQLite and Redis backends block; a copy keeps the loop free to update the job meanwhile
+        await asyncio.to_thread(self.backend.save, dict(job))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.backend.get(job_id)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job, payload = await self._queue.get()
+            try:
+                await self._run(job, payload)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: dict, payload: dict) -> None:
+        job.update(status="running", started_at=time.time())
+        await self._save(job)
+        try:
+            result = await self._handlers[job["kind"]](payload)
+            job.update(status="succeeded", result=result)
+        except asyncio.CancelledError:
+            job.update(status="cancelled", finished_at=time.time())
+            await self._save(job)
+            raise
+        except JobDeferred as e:
+            if job["deferrals"] < JOB_MAX_DEFERRALS:
+                JOBS.labels(job["kind"], "deferred").inc()
+                await self._defer(job, payload, e)
+                return
+            logger.error("Job %s (%s) gave up after %d deferrals: %s", job["id"], job["kind"], job["deferrals"], e)
+            job.update(status="failed", error=str(e))
+        except Exception as e:
+            logger.error("Job %s (%s) failed: %s", job["id"], job["kind"], str(e), exc_info=True)
+            job.update(status="failed", error=str(e))
+        job["finished_at"] = time.time()
+        await self._save(job)
+        JOBS.labels(job["kind"], job["status"]).inc()
+        logger.info(
+            "Job %s (%s) %s in %.2fs",
+            job["id"], job["kind"], job["status"], job["finished_at"] - job["started_at"],
+        )
+
+    async def _defer(self, job: dict, payload: dict, error: JobDeferred) -> None:
+        job["deferrals"] += 1
+        payload["deferrals"] = job["deferrals"]
+        job.update(status="deferred", error=str(error), retry_at=time.time() + error.delay)
+        await self._save(job)
+        logger.warning("Job %s (%s) deferred %.0fs: %s", job["id"], job["kind"], error.delay, error)
+
+        def requeue():
+            self._timers.pop(timer, None)
+            task = asyncio.create_task(self._requeue(job, payload))
+            self._requeues.add(task)
+            task.add_done_callback(self._requeues.discard)
+
+        timer = asyncio.get_running_loop().call_later(error.delay, requeue)
+        self._timers[timer] = (job, payload)
+
+    async def _requeue(self, job: dict, payload: dict) -> None:
+        if await self._enqueue(job, payload):
+            return
+        job.update(status="failed", error="Job queue is full; deferred job dropped", finished_at=time.time())
+        JOBS.labels(job["kind"], "failed").inc()
+        if job["kind"] in self._drop_handlers:
+            try:
+                await asyncio.to_thread(self._drop_handlers[job["kind"]], payload)
+            except Exception as e:
+                logger.error("Could not drop deferred job %s (%s): %s", job["id"], job["kind"], e)
+        await self._save(job)
+
+
+job_queue = JobQueue(make_backend())
@@ -1,15 +1,17 @@
-from typing import List, Dict
-from openai import OpenAI
+from typing import Awaitable, Callable, List, Dict, Optional
+import asyncio
 import os
 import json
-from ..config import OPENAI_API_KEY, OPENAI_MODEL,GOOGLE_API_KEY
+from ..config import OPENAI_MODEL, TESTCASE_MODEL, LLM_CONCURRENCY, CONSOLIDATION_BATCH_TOKENS
 from ..utils.logger import logger
-import google.generativeai as genai
-import json
-from typing import List, Dict
+from ..utils.metrics import span
+from ..utils.tokens import count_tokens, prompt_budget
+from .llm_providers import complete
+from .rate_limit import ProviderUnavailable
+from .review_cache import review_cache, cache_key
+from ..utils.finding_dedup import dedupe_findings
+from ..utils.chunker import number_chunk
 
-# Explicitly pass API key to avoid environment issues
-client = OpenAI(api_key=OPENAI_API_KEY)
 MODEL = OPENAI_MODEL
 
 SYSTEM = (
@@ -19,18 +21,23 @@ SYSTEM = (
 )
 SYSTEM_PROMPT = "You are a senior QA engineer helping generate high-quality software test cases."
 
+CATEGORIES = ("must_do", "good_to_have", "security")
+
+# Bump when the per-chunk prompt changes so cached reviews are not reused
+PROMPT_VERSION = "2"
+# tokens the line number column adds to each diff line sent for review
+LINE_NUMBER_TOKENS = 3
+
 # Fallback if model not set in config
 MODEL = OPENAI_MODEL or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 
-def review_diff_chunks(chunks: List[str]) -> Dict:
-    logger.info("Sending %d chunks to LLM (model=%s)", len(chunks), MODEL)
+class ReviewCancelled(Exception):
+    """Raised when a newer PR revision supersedes the one being reviewed."""
 
-    all_must_do, all_good_to_have, all_security = [], [], []
 
-    # --- Step 1: Per-chunk review ---
-    for idx, chunk in enumerate(chunks, 1):
-        prompt = f"""
+def _chunk_prompt(chunk: str) -> str:
+    return f"""
             You are reviewing a code diff.  
 
             Rules for reviewing:
@@ -40,8 +47,10 @@ def review_diff_chunks(chunks: List[str]) -> Dict:
                - **must_do**: Critical issues (runtime errors, bugs, security vulnerabilities).
                - **good_to_have**: Improvements (readability, maintainability, performance).
                - **security**: Security-specific issues.
-            4. When possible, reference the issue with line numbers from the diff, e.g., `"Line 42: Possible null pointer"`.
-            5. Keep feedback actionable and concise.
+            4. Each added or unchanged line is prefixed with its line number in the new file. Anchor every
+               finding to the file path (from the `+++ b/...` header) and that line number. Use "line": null
+               for findings that are not about one specific line.
+            5. Keep feedback actionable and concise; do not repeat the path or line number in the message.
 
             DIFF CHUNK START
             {chunk}
@@ -49,38 +58,237 @@ def review_diff_chunks(chunks: List[str]) -> Dict:
 
             Return only valid JSON in this format:
             {{
-                "must_do": ["..."],
-                "good_to_have": ["..."],
-                "security": ["..."]
+                "must_do": [{{"path": "src/app.py", "line": 42, "message": "..."}}],
+                "good_to_have": [{{"path": "src/app.py", "line": null, "message": "..."}}],
+                "security": []
             }}
         """
 
+
+def _anchor_findings(parsed: Dict, line_map: Dict[str, set]) -> Dict:
+    """
+    Split a chunk's findings into inline comments anchored to a line present
+    in the chunk's line map, and plain text findings for everything else.
+    """
+    result = {category: [] for category in CATEGORIES}
+    result["inline"] = []
+    paths = list(line_map)
+    for category in CATEGORIES:
+        for item in parsed.get(category, []) if isinstance(parsed, dict) else []:
+            if not isinstance(item, dict):
+                result[category].append(str(item))
+                continue
+            message = str(item.get("message") or "").strip()
+            if not message:
+                continue
+            path = str(item.get("path") or "").strip()
+            if path not in line_map and path[:2] in ("a/", "b/"):
+                path = path[2:]
+            if not path and len(paths) == 1:
+                path = paths[0]
+            try:
+                line = int(item.get("line"))
+            except (TypeError, ValueError):
+                line = None
+            if line is not None and line in line_map.get(path, ()):
+                result["inline"].append({"path": path, "line": line, "category": category, "message": message})
+            elif path and line is not None:
+                result[category].append(f"`{path}` line {line}: {message}")
+            elif path:
+                result[category].append(f"`{path}`: {message}")
+            else:
+                result[category].append(message)
+    return result
+
+
+async def _review_chunk(
+    idx: int, chunk: str, semaphore: asyncio.Semaphore, is_superseded: Optional[Callable[[], Awaitable[bool]]] = None
+) -> Dict:
+    numbered, line_map = number_chunk(chunk)
+    key = cache_key(MODEL, PROMPT_VERSION, chunk)
+    # SQLite-backed; kept off the event loop like the rest of the pipeline's I/O
+    cached = await asyncio.to_thread(review_cache.get, key)
+    if cached is not None:
+        logger.info("Chunk %d: cache hit", idx)
+        return _anchor_findings(cached, line_map)
+
+    async with semaphore:
+        # checked right before sending, so queued chunks of a stale revision are never sent
+        if is_superseded and await is_superseded():
+            raise ReviewCancelled(f"chunk {idx} skipped: revision superseded")
         try:
-            resp = client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {"role": "system", "content": SYSTEM},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.2,
-            )
-            content = resp.choices[0].message.content.strip()
+            content = await complete(MODEL, SYSTEM, _chunk_prompt(numbered), temperature=0.2)
 
             try:
                 parsed = json.loads(content)
+                await asyncio.to_thread(review_cache.set, key, parsed)
+                return _anchor_findings(parsed, line_map)
             except json.JSONDecodeError:
                 logger.warning("Chunk %d: Invalid JSON. Raw content: %s", idx, content)
-                parsed = {"must_do": [content], "good_to_have": [], "security": []}
-
-            all_must_do.extend(parsed.get("must_do", []))
-            all_good_to_have.extend(parsed.get("good_to_have", []))
-            all_security.extend(parsed.get("security", []))
+                return {"must_do": [content], "good_to_have": [], "security": []}
 
+        except ProviderUnavailable:
+            # defer the whole review rather than post one full of error items
+            raise
         except Exception as e:
             logger.error("Error reviewing chunk %d: %s", idx, str(e))
-            all_must_do.append(f"⚠️ Error reviewing chunk {idx}: {str(e)}")
+            return {"must_do": [f"⚠️ Error reviewing chunk {idx}: {str(e)}"], "good_to_have": [], "security": []}
+
+
+def chunk_token_budget() -> int:
+    """Tokens of diff that fit in one per-chunk review request for MODEL."""
+    reserved = count_tokens(SYSTEM + _chunk_prompt(""), MODEL)
+    return prompt_budget(MODEL, reserved=reserved)
+
+
+async def _gather_or_cancel(coros: list) -> list:
+    """gather() that cancels the remaining calls once one raises ReviewCancelled or ProviderUnavailable."""
+    tasks = [asyncio.create_task(c) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except (ReviewCancelled, ProviderUnavailable):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _merge_prompt(batch: Dict[str, List[str]]) -> str:
+    return f"""
+You are merging code review findings collected from several diff chunks.
+
+Rules:
+- Keep each finding in its category: 'must_do', 'good_to_have' or 'security'.
+- Merge findings that describe the same issue into one, keeping every file and line reference.
+- Do not drop distinct findings and do not add new ones.
+
+FINDINGS:
+{json.dumps(batch, ensure_ascii=False)}
+
+Return only JSON in this format:
+{{
+    "must_do": [...],
+    "good_to_have": [...],
+    "security": [...]
+}}
+"""
+
+
+async def _merge_batch(
+    level: int, idx: int, batch: Dict[str, List[str]], semaphore: asyncio.Semaphore,
+    is_superseded: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> Dict[str, List[str]]:
+    async with semaphore:
+        if is_superseded and await is_superseded():
+            raise ReviewCancelled(f"merge batch {level}.{idx} skipped: revision superseded")
+        try:
+            parsed = json.loads(await complete(MODEL, SYSTEM, _merge_prompt(batch), temperature=0.2))
+            return {category: [str(item) for item in parsed.get(category, [])] for category in CATEGORIES}
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            # keep the batch as it was; the next level or the final fallback still sees it
+            logger.warning("Merge batch %d.%d failed, keeping it unmerged: %s", level, idx, str(e))
+            return batch
+
+
+async def _reduce_findings(
+    findings: Dict[str, List[str]], semaphore: asyncio.Semaphore,
+    is_superseded: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> Dict[str, List[str]]:
+    """
+    Map-reduce consolidation: while the findings exceed CONSOLIDATION_BATCH_TOKENS,
+    split them into batches of at most that size, merge the batches in parallel
+    and repeat on the merged output. Calls grow with log(number of findings).
+    """
+    batch_budget = min(CONSOLIDATION_BATCH_TOKENS, prompt_budget(MODEL, cap=0))
+    level = 0
+    while True:
+        items = [(category, item) for category in CATEGORIES for item in findings.get(category, [])]
+        sizes = [count_tokens(item, MODEL) + 2 for _, item in items]
+        total = sum(sizes)
+        if total <= batch_budget:
+            return findings
+
+        batches, current, current_size = [], {c: [] for c in CATEGORIES}, 0
+        for (category, item), size in zip(items, sizes):
+            if current_size and current_size + size > batch_budget:
+                batches.append(current)
+                current, current_size = {c: [] for c in CATEGORIES}, 0
+            current[category].append(item)
+            current_size += size
+        batches.append(current)
+        if len(batches) == 1:
+            return findings
+
+        level += 1
+        logger.info(
+            "Reducing %d findings (%d tokens) in %d batches (level %d)", len(items), total, len(batches), level
+        )
+        merged = await _gather_or_cancel(
+            [_merge_batch(level, idx, batch, semaphore, is_superseded) for idx, batch in enumerate(batches, 1)]
+        )
+        reduced = {category: [item for batch in merged for item in batch[category]] for category in CATEGORIES}
+        reduced_total = sum(count_tokens(item, MODEL) + 2 for c in CATEGORIES for item in reduced[c])
+        if reduced_total >= total * 0.9:
+            logger.warning("Finding reduction stalled at %d tokens (level %d)", reduced_total, level)
+            return reduced
+        findings = reduced
+
+
+def _inline_overview(comments: List[Dict]) -> Dict:
+    """Counts per category plus the critical inline findings, for the consolidation prompt."""
+    overview = {"counts": {category: sum(c["category"] == category for c in comments) for category in CATEGORIES}}
+    for category in ("must_do", "security"):
+        overview[category] = [f"{c['path']}:{c['line']}: {c['message']}" for c in comments if c["category"] == category]
+    return overview
+
+
+async def review_diff_chunks(chunks: List[str], is_superseded: Optional[Callable[[], Awaitable[bool]]] = None) -> Dict:
+    """
+    Review chunks concurrently and consolidate the findings. `is_superseded`
+    is polled before each LLM call; once it returns True the remaining calls
+    are dropped and ReviewCancelled is raised.
+    """
+    logger.info("Sending %d chunks to LLM (model=%s, concurrency=%d)", len(chunks), MODEL, LLM_CONCURRENCY)
+
+    all_must_do, all_good_to_have, all_security, inline = [], [], [], {}
+
+    # --- Step 1: Per-chunk review (bounded concurrency, merged in chunk order) ---
+    semaphore = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+    with span("chunk_review"):
+        results = await _gather_or_cancel(
+            [_review_chunk(idx, chunk, semaphore, is_superseded) for idx, chunk in enumerate(chunks, 1)]
+        )
+    for parsed in results:
+        all_must_do.extend(parsed.get("must_do", []))
+        all_good_to_have.extend(parsed.get("good_to_have", []))
+        all_security.extend(parsed.get("security", []))
+        for comment in parsed.get("inline", []):
+            inline.setdefault((comment["path"], comment["line"], comment["message"]), comment)
+    inline_comments = sorted(inline.values(), key=lambda c: (c["path"], c["line"]))
+
+    if is_superseded and await is_superseded():
+        raise ReviewCancelled("consolidation skipped: revision superseded")
+
+    # --- Step 2: Collapse near-duplicate findings locally (shrinks the consolidation prompt) ---
+    with span("finding_dedup"):
+        all_must_do, all_good_to_have, all_security = await asyncio.to_thread(
+            lambda: tuple(dedupe_findings(items) for items in (all_must_do, all_good_to_have, all_security))
+        )
+
+    # --- Step 3: Tree-reduce findings in token-bounded batches until they fit one prompt ---
+    with span("finding_reduce"):
+        reduced = await _reduce_findings(
+            {"must_do": all_must_do, "good_to_have": all_good_to_have, "security": all_security},
+            semaphore,
+            is_superseded,
+        )
+    all_must_do, all_good_to_have, all_security = (
+        reduced["must_do"], reduced["good_to_have"], reduced["security"]
+    )
 
-    # --- Step 2: Consolidate ---
+    # --- Step 4: Consolidate ---
     final_prompt = f"""
 You are consolidating categorized findings from multiple diff chunks.  
 
@@ -93,13 +301,16 @@ Rules:
   - "flags": Array of flags like ["merge_ready"], ["needs_changes"], etc.
 
 MUST DO:
-{all_must_do}
+{json.dumps(all_must_do, ensure_ascii=False)}
 
 GOOD TO HAVE:
-{all_good_to_have}
+{json.dumps(all_good_to_have, ensure_ascii=False)}
 
 SECURITY:
-{all_security}
+{json.dumps(all_security, ensure_ascii=False)}
+
+LINE COMMENTS (posted inline separately; consider them for the summary, effort and flags but do not copy them into the lists):
+{json.dumps(_inline_overview(inline_comments), ensure_ascii=False)}
 
 Return only JSON in this format:
 {{
@@ -112,60 +323,68 @@ Return only JSON in this format:
 }}
     """
 
-    try:
-        resp2 = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM},
-                {"role": "user", "content": final_prompt},
-            ],
-            temperature=0.2,
+    prompt_tokens = count_tokens(SYSTEM + final_prompt, MODEL)
+    consolidation_budget = prompt_budget(MODEL, cap=0)
+    if prompt_tokens > consolidation_budget:
+        logger.warning(
+            "Consolidation prompt is %d tokens (budget %d); skipping LLM consolidation.",
+            prompt_tokens, consolidation_budget,
         )
-        consolidated_raw = resp2.choices[0].message.content.strip()
-
+        consolidated = {
+            "summary": "Too many findings to consolidate automatically; listing them per category.",
+            "must_do": all_must_do,
+            "good_to_have": all_good_to_have,
+            "security": all_security,
+            "effort_estimate": "medium",
+            "flags": ["needs_human_review"],
+        }
+    else:
         try:
-            consolidated = json.loads(consolidated_raw)
-        except json.JSONDecodeError:
-            logger.warning("Final consolidation not JSON. Using fallback.")
+            with span("consolidation"):
+                consolidated_raw = await complete(MODEL, SYSTEM, final_prompt, temperature=0.2)
+
+            try:
+                consolidated = json.loads(consolidated_raw)
+            except json.JSONDecodeError:
+                logger.warning("Final consolidation not JSON. Using fallback.")
+                consolidated = {
+                    "summary": consolidated_raw,
+                    "must_do": all_must_do,
+                    "good_to_have": all_good_to_have,
+                    "security": all_security,
+                    "effort_estimate": "medium",
+                    "flags": ["needs_human_review"],
+                }
+
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            logger.error("Error consolidating review: %s", str(e))
             consolidated = {
-                "summary": consolidated_raw,
-                "must_do": list(set(all_must_do)),
-                "good_to_have": list(set(all_good_to_have)),
-                "security": list(set(all_security)),
+                "summary": "⚠️ Error generating consolidated summary.",
+                "must_do": all_must_do,
+                "good_to_have": all_good_to_have,
+                "security": all_security,
                 "effort_estimate": "medium",
                 "flags": ["needs_human_review"],
             }
 
-    except Exception as e:
-        logger.error("Error consolidating review: %s", str(e))
-        consolidated = {
-            "summary": "⚠️ Error generating consolidated summary.",
-            "must_do": list(set(all_must_do)),
-            "good_to_have": list(set(all_good_to_have)),
-            "security": list(set(all_security)),
-            "effort_estimate": "medium",
-            "flags": ["needs_human_review"],
-        }
-
-    # --- Step 3: Final return (Markdown-friendly) ---
+    # --- Step 5: Final return (Markdown-friendly) ---
     return {
         "title": "🤖 AI Code Review",
         "summary": consolidated.get("summary", "Automated review across all diff chunks."),
-        "must_do": consolidated.get("must_do", list(set(all_must_do))),
-        "good_to_have": consolidated.get("good_to_have", list(set(all_good_to_have))),
-        "security": consolidated.get("security", list(set(all_security))),
+        "must_do": consolidated.get("must_do", all_must_do),
+        "good_to_have": consolidated.get("good_to_have", all_good_to_have),
+        "security": consolidated.get("security", all_security),
         "effort_estimate": consolidated.get("effort_estimate", "medium"),
         "flags": consolidated.get("flags", ["needs_human_review"]),
+        "inline_comments": inline_comments,
         "final_thoughts": "Treat this as assistance, not a replacement for human review.",
     }
 
 
-def generate_test_cases(epic_no: str, epic_title: str, pr_desc: str, pr_code: str):
-    """
-    Generate micro-level business/technical test cases from PR details.
-    Returns structured JSON.
-    """
-    prompt = f"""
+def _testcase_prompt(epic_no: str, epic_title: str, pr_desc: str, pr_code: str) -> str:
+    return f"""
 You are an expert QA engineer. Based on the software change details below, generate **micro-level test cases**. 
 Ensure comprehensive coverage including **functional scenarios, edge cases, negative cases, boundary conditions, and possible regressions**.
 
@@ -207,126 +426,43 @@ Do not include any text outside the JSON array. Generate **all relevant test cas
 """
 
 
-    try:
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-        )
-
-        raw_content = resp.choices[0].message.content.strip()
-
-        # Try parsing as JSON
-        try:
-            test_cases = json.loads(raw_content)
-        except json.JSONDecodeError:
-            # fallback: wrap into a single test case
-            test_cases = [{
-                "description": "Generated test case (raw response)",
-                "steps": [raw_content],
-                "expected_result": "See description"
-            }]
-        
-        return test_cases
-
-    except Exception as e:
-        return [{
-            "description": f"⚠️ Error generating test cases: {str(e)}",
-            "steps": [],
-            "expected_result": "N/A"
-        }]
-    
-
-def generate_test_cases_gemini(epic_no: str, epic_title: str, pr_desc: str, pr_code: str):
+async def generate_test_cases(
+    epic_no: str, epic_title: str, pr_desc: str, pr_code: str, model: str = TESTCASE_MODEL
+):
     """
-    Generate micro-level business/technical test cases from PR details using the Gemini API.
-    Returns structured JSON.
+    Generate micro-level business/technical test cases from PR details.
+    `model` picks the provider (e.g. "gpt-4o-mini", "gemini-pro", "stub").
+    Returns a list of test case dicts, or None if generation failed or the
+    reply was not a list of objects, so nothing is stored for the merge.
     """
-    # Configure the Gemini API with your API key
-    # It's recommended to store your API key in an environment variable
-    genai.configure(api_key=GOOGLE_API_KEY)
-
-    # Define the prompt for the Gemini model
-    prompt = f"""
-You are an expert QA engineer. Based on the software change details below, generate **micro-level test cases**.
-Ensure comprehensive coverage including **functional scenarios, edge cases, negative cases, boundary conditions, and possible regressions**.
-
-Epic: {epic_no} - {epic_title}
-
-Requirement Description:
-{pr_desc}
-
-Relevant Code Changes:
-{pr_code}
-
-For each test case, include:
-- "description": A concise summary of what is being tested.
-- "preconditions": Any setup required before executing the test.
-- "steps": Step-by-step actions to perform the test.
-- "expected_result": The expected outcome after performing the steps.
-- "priority": High, Medium, or Low.
-
-Format your response as a **JSON array** only, like this:
-
-[
-  {{
-    "description": "Test case 1 description",
-    "preconditions": "Any setup or state required",
-    "steps": ["Step 1", "Step 2", "..."],
-    "expected_result": "Expected outcome",
-    "priority": "High"
-  }},
-  {{
-    "description": "Test case 2 description",
-    "preconditions": "",
-    "steps": ["Step 1", "Step 2", "..."],
-    "expected_result": "Expected outcome",
-    "priority": "Medium"
-  }}
-]
-
-Do not include any text outside the JSON array. Generate **all relevant test cases** needed to cover the requirement thoroughly.
-"""
+    prompt = _testcase_prompt(epic_no, epic_title, pr_desc, pr_code)
 
     try:
-        # Initialize the Gemini model
-        model = genai.GenerativeModel('gemini-pro')
-
-        # Make the API call
-        # The prompt is passed directly to the generate_content method
-        response = model.generate_content(prompt)
-
-        # Access the raw content from the response
-        raw_content = response.text.strip()
-
-        # Try parsing as JSON
-        try:
-            test_cases = json.loads(raw_content)
-        except json.JSONDecodeError:
-            # Fallback for when the model doesn't return perfect JSON
-            print("Warning: Failed to parse JSON. Attempting to fix or use raw content.")
-            # This is a good place to add more robust parsing logic if needed
-            test_cases = [{
-                "description": "Generated test case (raw response)",
-                "steps": [raw_content],
-                "expected_result": "See description",
-                "priority": "High"
-            }]
-
-        return test_cases
-
+        raw_content = await complete(model, SYSTEM_PROMPT, prompt, temperature=0.3)
     except Exception as e:
+        logger.error("Test case generation with %s failed: %s", model, e)
+        return None
+
+    # Try parsing as JSON
+    try:
+        test_cases = json.loads(raw_content)
+    except json.JSONDecodeError:
+        # fallback: wrap into a single test case
+        logger.warning("Test case response from %s is not JSON; using raw content", model)
         return [{
-            "description": f"⚠️ Error generating test cases: {str(e)}",
+            "description": "Generated test case (raw response)",
             "preconditions": "",
-            "steps": [],
-            "expected_result": "N/A",
+            "steps": [raw_content],
+            "expected_result": "See description",
             "priority": "High"
         }]
 
+    if not isinstance(test_cases, list) or not all(isinstance(tc, dict) for tc in test_cases):
+        logger.error("Test case response from %s is not a JSON array of objects", model)
+        return None
+    return test_cases
+
+
 # Example usage:
 if __name__ == '__main__':
     # Assuming these variables hold your PR details
@@ -352,5 +488,7 @@ if __name__ == '__main__':
                         # ... mapping logic ...
     """
     
-    test_cases_output = generate_test_cases_gemini(epic_number, epic_title, pr_description, pr_code)
+    test_cases_output = asyncio.run(
+        generate_test_cases(epic_number, epic_title, pr_description, pr_code, model="gemini-pro")
+    )
     print(json.dumps(test_cases_output, indent=2))
\ No newline at end of file
@@ -1,7 +1,23 @@
-from wsgiref import headers
-import requests
+import asyncio
+import hashlib
 import json
-from ..config import NOTION_TESTCASES_DB_ID, NOTION_API_KEY, NOTION_BACKLOG_DB_ID
+import time
+from typing import Dict, Iterator, List, Optional
+import requests
+from ..utils import http
+from ..utils.logger import logger
+from ..utils.metrics import timed
+from ..config import (
+    NOTION_TESTCASES_DB_ID, NOTION_API_KEY, NOTION_BACKLOG_DB_ID, NOTION_API_BASE,
+    NOTION_EPIC_ID_PROPERTY, NOTION_INDEX_REFRESH_SECONDS,
+    NOTION_CONCURRENCY, NOTION_REQUESTS_PER_SECOND,
+)
+from .notion_cache import (
+    get_epic, save_epics, get_sync_state, set_sync_state,
+    get_page_content, save_page_content,
+    get_testcase_write, save_testcase_write,
+)
+from .rate_limit import ModelLimiter
 
 HEADERS = {
     "Authorization": f"Bearer {NOTION_API_KEY}",
@@ -10,35 +26,93 @@ HEADERS = {
      "accept": "application/json",
 }
 
-def fetch_epic_from_notion(epic_no: str):
+def _query_backlog(filter_: dict) -> Iterator[dict]:
+    """Rows of the backlog database matching a Notion filter, following pagination."""
+    url = f"{NOTION_API_BASE}/databases/{NOTION_BACKLOG_DB_ID}/query"
+    body = {"filter": filter_, "page_size": 100}
+    while True:
+        response = http.post(url, headers=HEADERS, json=body, idempotent=True)
+        response.raise_for_status()
+        data = response.json()
+        yield from data.get("results", [])
+        if not data.get("has_more") or not data.get("next_cursor"):
+            return
+        body["start_cursor"] = data["next_cursor"]
+
+
+def _index_rows(rows: List[dict]) -> None:
+    epics = []
+    for row in rows:
+        number = ((row.get("properties", {}).get(NOTION_EPIC_ID_PROPERTY) or {}).get("unique_id") or {}).get("number")
+        if number is not None:
+            epics.append((number, row["id"], row.get("last_edited_time", "")))
+    save_epics(NOTION_BACKLOG_DB_ID, epics)
+
+
+def _watermark() -> str:
+    # Notion rounds last_edited_time to the minute
+    return time.strftime("%Y-%m-%dT%H:%M:00.000Z", time.gmtime(time.time() - 60))
+
+
+def refresh_epic_index(force: bool = False) -> int:
+    """
+    Pull epics edited since the last sync into the local index; at most once
+    per NOTION_INDEX_REFRESH_SECONDS unless forced. The first call only sets
+    the watermark: older epics are indexed on their first lookup.
+    """
+    state = get_sync_state(NOTION_BACKLOG_DB_ID)
+    watermark = _watermark()
+    if state is None:
+        set_sync_state(NOTION_BACKLOG_DB_ID, watermark)
+        return 0
+    if not force and time.time() - state["synced_at"] < NOTION_INDEX_REFRESH_SECONDS:
+        return 0
+    rows = list(_query_backlog({"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": state["watermark"]}}))
+    _index_rows(rows)
+    set_sync_state(NOTION_BACKLOG_DB_ID, watermark)
+    logger.info("Notion epic index: %d epics changed since %s", len(rows), state["watermark"])
+    return len(rows)
+
+
+def find_epic(number: int) -> Optional[dict]:
+    """
+    {"page_id", "last_edited_time"} of an epic by its unique ID, with at most
+    one Notion round trip: an index hit costs an incremental refresh when one
+    is due, a miss costs one filtered query.
+    """
+    epic = get_epic(NOTION_BACKLOG_DB_ID, number)
+    if epic:
+        try:
+            if refresh_epic_index():
+                epic = get_epic(NOTION_BACKLOG_DB_ID, number)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Notion epic index refresh failed, using indexed entry: %s", e)
+        return epic
+
+    # edits made after this lookup must be picked up by the next refresh
+    if get_sync_state(NOTION_BACKLOG_DB_ID) is None:
+        set_sync_state(NOTION_BACKLOG_DB_ID, _watermark())
+    rows = list(_query_backlog({"property": NOTION_EPIC_ID_PROPERTY, "unique_id": {"equals": number}}))
+    _index_rows(rows)
+    return get_epic(NOTION_BACKLOG_DB_ID, number)
+
+
+@timed("notion.fetch_epic")
+async def fetch_epic_from_notion(epic_no: str):
     """
     Fetch Epic details from Notion Epic DB by Epic No.
     Returns dict with Epic Name, PRD, Tech Notes.
     """ 
-    print(NOTION_BACKLOG_DB_ID,'NOTION_BACKLOG_DB_ID')
-
-    url = "https://api.notion.com/v1/databases/{NOTION_BACKLOG_DB_ID}/query"
-    
-    print(epic_no,'epic_no')
     value = epic_no.split("-")[1]
-    print(value,'value')
-
+    logger.info("Looking up %s in Notion database %s", epic_no, NOTION_BACKLOG_DB_ID)
 
     try:
-        response = requests.post(url, headers=HEADERS,json={})
-        response.raise_for_status()
-        results = response.json()
-        epic = None
-        for row in results["results"]:
-            if  row["properties"]["04"]["unique_id"]["number"] == int(value):
-                epic = row
-                break
-        
+        epic = await asyncio.to_thread(find_epic, int(value))
 
         if not epic:
             return None
 
-        page = fetch_page_content(epic["id"])
+        page = await fetch_page_content(epic["page_id"], epic["last_edited_time"])
 
         if not page:
             return None
@@ -46,52 +120,104 @@ def fetch_epic_from_notion(epic_no: str):
         epic_details = {
             "Epic No": epic_no,
             "PRD": page,
-            "epicPageId": epic["id"],
+            "epicPageId": epic["page_id"],
+            "lastEditedTime": epic["last_edited_time"],
         }
 
         return epic_details
     except requests.exceptions.HTTPError as e:
-        print("Status Code:", response.status_code)
-        print("Error Response:", response.text)  # <-- Add this
+        logger.error("Notion query for %s failed (%s): %s", epic_no, e.response.status_code, e.response.text)
     except Exception as e:
-        print("Unexpected Error:", e)
+        logger.error("Unexpected error fetching %s from Notion: %s", epic_no, e)
         return ""
 
 
-def fetch_page_content(page_id: str) -> str:
-    """Recursively fetch content from a Notion page."""
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-    all_texts = []
+# Notion allows ~3 requests/s per integration; shared by every async Notion call in the process
+_notion_limiter = ModelLimiter(rpm=NOTION_REQUESTS_PER_SECOND * 60, tpm=0, burst=NOTION_CONCURRENCY)
+_notion_semaphore: Optional[asyncio.Semaphore] = None
 
-    try:
-        while url:
-            response = requests.get(url, headers=HEADERS)
-            response.raise_for_status()
-            data = response.json()
 
-            for block in data.get("results", []):
-                all_texts.append(fetch_block_text(block))
+async def _notion_call(method: str, url: str, **kwargs) -> requests.Response:
+    """One pooled, retried Notion request, within the shared concurrency and rate limits."""
+    global _notion_semaphore
+    if _notion_semaphore is None:
+        _notion_semaphore = asyncio.Semaphore(NOTION_CONCURRENCY)
+    async with _notion_semaphore:
+        await _notion_limiter.acquire("notion", 0)
+        return await asyncio.to_thread(http.request, method, url, headers=HEADERS, **kwargs)
+
 
-                # If block has children, fetch them recursively
-                if block.get("has_children"):
-                    all_texts.append(fetch_page_content(block["id"]))
+async def _list_children(block_id: str) -> List[dict]:
+    """
+    All child blocks of a block, following pagination. Not cached per block:
+    editing a nested block does not change its parent's last_edited_time.
+    """
+    blocks: List[dict] = []
+    cursor = None
+    while True:
+        params = {"page_size": 100}
+        if cursor:
+            params["start_cursor"] = cursor
+        response = await _notion_call("GET", f"{NOTION_API_BASE}/blocks/{block_id}/children", params=params)
+        response.raise_for_status()
+        data = response.json()
+        blocks.extend(data.get("results", []))
+        cursor = data.get("next_cursor")
+        if not data.get("has_more") or not cursor:
+            break
 
-            # Pagination: Notion returns `next_cursor` for large pages
-            url = data.get("next_cursor")
-            if url:
-                url = f"https://api.notion.com/v1/blocks/{page_id}/children?start_cursor={url}"
+    return blocks
 
-        return "\n".join(all_texts)
+
+async def _fetch_tree(page_id: str) -> str:
+    """Breadth-first: every block list of one depth is fetched concurrently."""
+    children: Dict[str, List[dict]] = {}
+    level = [page_id]
+    while level:
+        listings = await asyncio.gather(*[_list_children(block_id) for block_id in level])
+        next_level = []
+        for block_id, blocks in zip(level, listings):
+            children[block_id] = blocks
+            next_level.extend(block["id"] for block in blocks if block.get("has_children"))
+        level = next_level
+
+    def render(block_id: str) -> str:
+        # document order, as the page reads
+        texts = []
+        for block in children.get(block_id, []):
+            texts.append(fetch_block_text(block))
+            if block.get("has_children"):
+                texts.append(render(block["id"]))
+        return "\n".join(texts)
+
+    return render(page_id)
+
+
+async def fetch_page_content(page_id: str, last_edited_time: str = "") -> str:
+    """
+    Text content of a Notion page and all its nested blocks. With the page's
+    last_edited_time an unchanged page is served from the local cache.
+    """
+    try:
+        if last_edited_time:
+            cached = await asyncio.to_thread(get_page_content, page_id, last_edited_time)
+            if cached is not None:
+                logger.info("Notion page %s unchanged since %s; using cached content", page_id, last_edited_time)
+                return cached
+
+        content = await _fetch_tree(page_id)
+        if last_edited_time and content:
+            await asyncio.to_thread(save_page_content, page_id, last_edited_time, content)
+        return content
 
     except requests.exceptions.HTTPError as e:
-        print("HTTP Error:", e)
-        print("Response:", response.text)
+        logger.error("Notion page %s: %s: %s", page_id, e, e.response.text)
         return ""
     except requests.exceptions.RequestException as e:
-        print("Request Error:", e)
+        logger.error("Notion page %s: request error: %s", page_id, e)
         return ""
     except Exception as e:
-        print("Unexpected Error:", e)
+        logger.error("Notion page %s: unexpected error: %s", page_id, e)
         return ""
 
 
@@ -115,28 +241,92 @@ def fetch_block_text(block):
     return "\n".join(texts)
 
 
-def save_testcases_to_notion(epic_page_id, testcases):
-    url = "https://api.notion.com/v1/pages"
-    headers = HEADERS
-    
-    for tc in testcases:
-        payload = {
-            "parent": {"database_id": NOTION_TESTCASES_DB_ID},
-            "properties": {
-                # Relation to EPIC table
-                "EPIC": {
-                    "relation": [{"id": epic_page_id}]
-                },
-                "Test Case Description": {
-                    "title": [{"text": {"content": tc["description"]}}]
-                },
-                "Test Steps": {
-                    "rich_text": [{"text": {"content": "\n".join(tc["steps"])}}]
-                },
-                "Expected Result": {
-                    "rich_text": [{"text": {"content": tc["expected_result"]}}]
-                },
-            }
+# Notion caps each rich_text object at 2000 characters and a property at 100 of them
+RICH_TEXT_LIMIT = 2000
+RICH_TEXT_MAX_SEGMENTS = 100
+
+
+def _rich_text(text: str) -> List[dict]:
+    """Split text into as many rich_text objects as the Notion limit requires."""
+    text = str(text or "")
+    segments = [text[i:i + RICH_TEXT_LIMIT] for i in range(0, len(text), RICH_TEXT_LIMIT)] or [""]
+    if len(segments) > RICH_TEXT_MAX_SEGMENTS:
+        segments = segments[:RICH_TEXT_MAX_SEGMENTS]
+        segments[-1] = segments[-1][:-1] + "…"
+    return [{"text": {"content": segment}} for segment in segments]
+
+
+def testcase_key(epic_page_id: str, run_key: str, index: int) -> str:
+    """
+    Idempotency key from stable inputs only: the epic, the merge that produced
+    the cases and the case's position, never the LLM-generated text.
+    """
+    raw = json.dumps([epic_page_id, run_key, index])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _testcase_page(epic_page_id: str, tc: dict) -> dict:
+    steps = tc.get("steps") or []
+    if isinstance(steps, list):
+        steps = "\n".join(str(step) for step in steps)
+    return {
+        "parent": {"database_id": NOTION_TESTCASES_DB_ID},
+        "properties": {
+            # Relation to EPIC table
+            "EPIC": {
+                "relation": [{"id": epic_page_id}]
+            },
+            "Test Case Description": {
+                "title": _rich_text(tc["description"])
+            },
+            "Test Steps": {
+                "rich_text": _rich_text(steps)
+            },
+            "Expected Result": {
+                "rich_text": _rich_text(tc.get("expected_result", ""))
+            },
         }
-        response = requests.post(url, headers=headers, json=payload)
+    }
+
+
+async def _save_testcase(epic_page_id: str, run_key: str, index: int, tc: dict) -> dict:
+    description = str(tc.get("description", "")) if isinstance(tc, dict) else str(tc)
+    result = {"description": description[:200], "status": "failed", "page_id": None, "error": None}
+    try:
+        key = testcase_key(epic_page_id, run_key, index)
+        existing = await asyncio.to_thread(get_testcase_write, key)
+        if existing:
+            return dict(result, status="exists", page_id=existing)
+
+        # not idempotent: after a timeout or 5xx the page may exist, so only 429s are retried
+        response = await _notion_call("POST", f"{NOTION_API_BASE}/pages", json=_testcase_page(epic_page_id, tc))
+        if response.status_code not in (200, 201):
+            return dict(result, error=f"{response.status_code}: {response.text[:500]}")
+        page_id = response.json().get("id")
+        await asyncio.to_thread(save_testcase_write, key, epic_page_id, page_id)
+        return dict(result, status="created", page_id=page_id)
+    except Exception as e:
+        return dict(result, error=str(e))
 
+
+@timed("notion.save_testcases")
+async def save_testcases_to_notion(epic_page_id, testcases, run_key: str) -> List[dict]:
+    """
+    Create one Notion page per test case, concurrently within the shared
+    Notion limits. `run_key` identifies the merge the cases were generated
+    for; cases already written for it (e.g. by an earlier delivery of the
+    same merge webhook) are not written again. Returns one
+    {"description", "status": created|exists|failed, "page_id", "error"} per case.
+    """
+    results = await asyncio.gather(
+        *[_save_testcase(epic_page_id, run_key, index, tc) for index, tc in enumerate(testcases or [])]
+    )
+    failed = [r for r in results if r["status"] == "failed"]
+    for r in failed:
+        logger.error("Failed to store test case %r: %s", r["description"], r["error"])
+    logger.info(
+        "Stored test cases for %s: %d created, %d already present, %d failed",
+        epic_page_id, sum(r["status"] == "created" for r in results),
+        sum(r["status"] == "exists" for r in results), len(failed),
+    )
+    return list(results)
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from typing import Iterable, Optional
+from ..utils.db import connect
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect()
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS notion_epics ("
+            "database_id TEXT NOT NULL, number INTEGER NOT NULL, page_id TEXT NOT NULL, "
+            "last_edited_time TEXT NOT NULL, PRIMARY KEY (database_id, number))"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS notion_sync ("
+            "database_id TEXT PRIMARY KEY, watermark TEXT NOT NULL, synced_at REAL NOT NULL)"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS notion_page_content ("
+            "page_id TEXT PRIMARY KEY, last_edited_time TEXT NOT NULL, content TEXT NOT NULL, cached_at REAL NOT NULL)"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS notion_testcase_writes ("
+            "key TEXT PRIMARY KEY, epic_page_id TEXT NOT NULL, page_id TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS notion_testcase_runs ("
+            "run_key TEXT PRIMARY KEY, testcases TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+    return _conn
+
+
+def get_epic(database_id: str, number: int) -> Optional[dict]:
+    with _lock:
+        row = _db().execute(
+            "SELECT page_id, last_edited_time FROM notion_epics WHERE database_id = ? AND number = ?",
+            (database_id, number),
+        ).fetchone()
+    return {"page_id": row["page_id"], "last_edited_time": row["last_edited_time"]} if row else None
+
+
+def save_epics(database_id: str, epics: Iterable[tuple]) -> None:
+    """Upsert (number, page_id, last_edited_time) rows; an older edit never overwrites a newer one."""
+    with _lock:
+        _db().executemany(
+            "INSERT INTO notion_epics (database_id, number, page_id, last_edited_time) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(database_id, number) DO UPDATE SET page_id = excluded.page_id, "
+            "last_edited_time = excluded.last_edited_time "
+            "WHERE excluded.last_edited_time >= notion_epics.last_edited_time",
+            [(database_id, number, page_id, edited) for number, page_id, edited in epics],
+        )
+
+
+def get_sync_state(database_id: str) -> Optional[dict]:
+    with _lock:
+        row = _db().execute(
+            "SELECT watermark, synced_at FROM notion_sync WHERE database_id = ?", (database_id,)
+        ).fetchone()
+    return {"watermark": row["watermark"], "synced_at": row["synced_at"]} if row else None
+
+
+def set_sync_state(database_id: str, watermark: str) -> None:
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO notion_sync (database_id, watermark, synced_at) VALUES (?, ?, ?)",
+            (database_id, watermark, time.time()),
+        )
+
+
+def get_page_content(page_id: str, last_edited_time: str) -> Optional[str]:
+    """Rendered page text, if cached for exactly this edit of the page."""
+    with _lock:
+        row = _db().execute(
+            "SELECT content FROM notion_page_content WHERE page_id = ? AND last_edited_time = ?",
+            (page_id, last_edited_time),
+        ).fetchone()
+    return row["content"] if row else None
+
+
+def save_page_content(page_id: str, last_edited_time: str, content: str) -> None:
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO notion_page_content (page_id, last_edited_time, content, cached_at) "
+            "VALUES (?, ?, ?, ?)",
+            (page_id, last_edited_time, content, time.time()),
+        )
+
+
+def get_testcase_write(key: str) -> Optional[str]:
+    """Notion page id of a test case already written under this idempotency key."""
+    with _lock:
+        row = _db().execute("SELECT page_id FROM notion_testcase_writes WHERE key = ?", (key,)).fetchone()
+    return row["page_id"] if row else None
+
+
+def save_testcase_write(key: str, epic_page_id: str, page_id: str) -> None:
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO notion_testcase_writes (key, epic_page_id, page_id, created_at) VALUES (?, ?, ?, ?)",
+            (key, epic_page_id, page_id, time.time()),
+        )
+
+
+def get_testcase_run(run_key: str) -> Optional[list]:
+    """Test cases generated earlier for this merge, so a redelivery writes the same cases."""
+    with _lock:
+        row = _db().execute("SELECT testcases FROM notion_testcase_runs WHERE run_key = ?", (run_key,)).fetchone()
+    return json.loads(row["testcases"]) if row else None
+
+
+def save_testcase_run(run_key: str, testcases: list) -> None:
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO notion_testcase_runs (run_key, testcases, created_at) VALUES (?, ?, ?)",
+            (run_key, json.dumps(testcases), time.time()),
+        )
@@ -0,0 +1,229 @@
+import asyncio
+from typing import List, Tuple
+import requests
+from ..config import POST_PR_COMMENT, UPDATE_PR_COMMENT, POST_INLINE_COMMENTS, MAX_INLINE_COMMENTS, SEND_EMAIL, INCREMENTAL_REVIEW, PR_DEDUP_TTL, JOB_MAX_DEFERRALS
+from .bitbucket import (
+    stream_pr_diff, stream_commit_diff, post_pr_comment, upsert_pr_comment, post_inline_comments, inline_comment_key,
+)
+from .llm import review_diff_chunks, chunk_token_budget, MODEL, LINE_NUMBER_TOKENS, ReviewCancelled
+from .review_formatter import format_review
+from .email_ses import email_dispatcher
+from .dedup import dedup_store
+from .jobs import JobDeferred
+from .rate_limit import ProviderUnavailable, fair_key
+from .review_state import (
+    get_review_state, save_review_state, get_latest_revision, merge_sections, get_inline_comment,
+)
+from .review_store import save_review
+from ..utils.chunker import pack_files
+from ..utils.diff_filter import select_files
+from ..utils.diff_parser import parse_diff
+from ..utils.logger import logger
+from ..utils.metrics import CHUNKS, DIFF_BYTES, span
+from ..utils.tokens import count_tokens
+
+
+async def run_pr_review(job: dict) -> dict:
+    """
+    Background job: fetch -> review -> post -> email for one PR webhook.
+    Marks the webhook's dedup key done on success and releases it on failure
+    so a redelivery can retry. While the LLM provider is unavailable the job
+    is deferred and keeps its dedup lease.
+    """
+    key = job.get("dedup_key")
+    # LLM calls are queued fairly per PR, so one large PR cannot hold up the rest
+    token = fair_key.set(f"{job['repo_slug']}#{job['pr_id']}")
+    try:
+        result = await _review_pr(job)
+    except ProviderUnavailable as e:
+        if job.get("deferrals", 0) < JOB_MAX_DEFERRALS:
+            raise JobDeferred(str(e), e.retry_after) from e
+        if key:
+            await asyncio.to_thread(dedup_store.release, key)
+        raise
+    except ReviewCancelled as e:
+        logger.info("Review of %s PR#%s at %s superseded: %s", job["repo_slug"], job["pr_id"], job.get("head_commit"), e)
+        result = {"superseded": True, "commit": job.get("head_commit")}
+    except BaseException:
+        if key:
+            await asyncio.to_thread(dedup_store.release, key)
+        raise
+    finally:
+        fair_key.reset(token)
+    if key:
+        await asyncio.to_thread(dedup_store.complete, key, PR_DEDUP_TTL)
+    return result
+
+
+def _prepare_chunks(diff_lines, repo_slug: str) -> Tuple[List[str], List[dict]]:
+    # diff lines are sent with a line number column; leave room for it
+    size_fn = lambda text: count_tokens(text, MODEL) + LINE_NUMBER_TOKENS * text.count("\n")
+    files, skipped = select_files(parse_diff(diff_lines), repo_slug, size_fn)
+    return pack_files(files, chunk_token_budget(), size_fn), skipped
+
+
+def drop_pr_review(job: dict) -> None:
+    """A review dropped unrun (shutdown or a full queue): release its dedup key so a redelivery is accepted."""
+    if job.get("dedup_key"):
+        dedup_store.release(job["dedup_key"])
+
+
+def _retire_inline_comments(repo_slug: str, pr_id: int, prior: dict) -> dict:
+    """
+    Prior findings for merging into an incremental review. Inline comments of
+    the earlier revision carry its line numbers, so they are never posted
+    again: posted ones are already on the PR and are dropped, unposted ones
+    become text findings that name the revision they refer to.
+    """
+    sections = {k: list(v) if isinstance(v, list) else v for k, v in prior["sections"].items()}
+    for comment in sections.pop("inline_comments", []):
+        if get_inline_comment(repo_slug, pr_id, inline_comment_key(comment)):
+            continue
+        text = f"`{comment['path']}` line {comment['line']} (at {prior['commit'][:12]}): {comment['message']}"
+        sections.setdefault(comment.get("category") or "good_to_have", []).append(text)
+    return sections
+
+
+def _empty_review() -> dict:
+    return {
+        "title": "🤖 AI Code Review",
+        "summary": "No reviewable changes: every file in this diff was filtered out.",
+        "must_do": [],
+        "good_to_have": [],
+        "security": [],
+        "effort_estimate": "low",
+        "flags": ["needs_human_review"],
+        "final_thoughts": "Treat this as assistance, not a replacement for human review.",
+    }
+
+
+async def _review_pr(job: dict) -> dict:
+    """Blocking SDK calls run in a thread so the event loop keeps serving webhooks."""
+    repo_slug = job["repo_slug"]
+    pr_id = job["pr_id"]
+    author_display = job["author_display"]
+    author_email = job["author_email"]
+
+    head_commit = job.get("head_commit")
+
+    logger.info("Reviewing repo=%s PR#%s at %s", repo_slug, pr_id, head_commit)
+
+    async def is_superseded() -> bool:
+        if not head_commit:
+            return False
+        latest = await asyncio.to_thread(get_latest_revision, repo_slug, pr_id)
+        return bool(latest) and latest != head_commit
+
+    if await is_superseded():
+        raise ReviewCancelled("a newer revision was pushed before this job started")
+
+    # 1) Fetch diff: only the interdiff since the last reviewed commit when we have one
+    prior = None
+    if INCREMENTAL_REVIEW and head_commit:
+        prior = await asyncio.to_thread(get_review_state, repo_slug, pr_id)
+        if prior and prior["commit"] == head_commit:
+            logger.info("PR#%s in %s already reviewed at %s; skipping", pr_id, repo_slug, head_commit)
+            return {"skipped": "revision already reviewed", "commit": head_commit}
+
+    diff = None
+    if prior:
+        try:
+            with span("diff_fetch"):
+                diff = await asyncio.to_thread(stream_commit_diff, repo_slug, head_commit, prior["commit"])
+        except requests.RequestException as e:
+            # e.g. the old commit is gone after a force-push
+            logger.warning("Interdiff unavailable for PR#%s (%s); reviewing the full diff", pr_id, e)
+            prior = None
+    if diff is None:
+        with span("diff_fetch"):
+            diff = await asyncio.to_thread(stream_pr_diff, job["diff_url"])
+
+    # 2) Filter, rank and chunk (the diff is read from the network meanwhile), then review via LLM
+    # includes reading the diff body, which is streamed into the chunker
+    with span("chunking"):
+        chunks, skipped = await asyncio.to_thread(_prepare_chunks, diff, repo_slug)
+    DIFF_BYTES.observe(diff.bytes_read)
+    CHUNKS.observe(len(chunks))
+    logger.info("PR#%s: %d diff bytes in %d chunks", pr_id, diff.bytes_read, len(chunks))
+    if prior and not chunks:
+        logger.info("Interdiff for PR#%s is empty; keeping previous review", pr_id)
+        await asyncio.to_thread(save_review_state, repo_slug, pr_id, head_commit, prior["sections"])
+        return {"skipped": "no new changes", "commit": head_commit}
+    if chunks:
+        sections = await review_diff_chunks(chunks, is_superseded)
+    else:
+        sections = _empty_review()
+    if skipped:
+        sections["skipped_files"] = skipped
+    if diff.truncated:
+        sections["notes"] = [
+            f"Diff exceeded {diff.max_bytes} bytes; only the first {diff.bytes_read} bytes were reviewed."
+        ]
+    if prior:
+        prior_sections = await asyncio.to_thread(_retire_inline_comments, repo_slug, pr_id, prior)
+        sections = await asyncio.to_thread(merge_sections, prior_sections, sections)
+    # only the latest head gets recorded and posted
+    if await is_superseded():
+        raise ReviewCancelled("a newer revision was pushed during the review")
+    if head_commit:
+        await asyncio.to_thread(save_review_state, repo_slug, pr_id, head_commit, sections)
+    review_id = await asyncio.to_thread(
+        save_review, repo_slug, pr_id, head_commit, sections, MODEL, bool(prior)
+    )
+
+    # 3) Post line-anchored findings as inline comments; whatever is not
+    # posted (over the cap, or failed) is listed in the summary comment instead
+    inline = sections.get("inline_comments", [])
+    inline_results = []
+    comment_sections = sections
+    if POST_PR_COMMENT and POST_INLINE_COMMENTS and inline:
+        with span("inline_comment_post"):
+            inline_results = await post_inline_comments(repo_slug, pr_id, inline[:MAX_INLINE_COMMENTS])
+        posted = [c for c, r in zip(inline, inline_results) if r["status"] != "failed"]
+        unposted = [c for c, r in zip(inline, inline_results) if r["status"] == "failed"]
+        comment_sections = dict(
+            sections, inline_posted=posted, inline_comments=unposted + inline[MAX_INLINE_COMMENTS:]
+        )
+
+    # 4) Format: a short overview for the PR, every finding for the email
+    with span("format"):
+        comment_md = format_review(comment_sections)
+        body_md = format_review(sections) if comment_sections is not sections else comment_md
+
+    # 5) Post PR comment, or edit the one posted for an earlier revision
+    result = None
+    if POST_PR_COMMENT:
+        post = upsert_pr_comment if UPDATE_PR_COMMENT else post_pr_comment
+        with span("comment_post"):
+            result = await asyncio.to_thread(post, repo_slug, pr_id, comment_md)
+
+    # 6) Email (optional): queued, sent in the background under the SES rate
+    emailed = False
+    if SEND_EMAIL and author_email:
+        html = f"""<h3>Hello {author_display},</h3>
+        <p>Here is the AI-generated review for PR <b>#{pr_id}</b> in <b>{repo_slug}</b>:</p>
+        <pre style="background:#f6f8fa;padding:12px;white-space:pre-wrap">{body_md}</pre>
+        <p><em>This is an automated message.</em></p>
+        """
+        emailed = email_dispatcher.enqueue(
+            to_email=author_email,
+            subject=f"AI Code Review: {repo_slug} PR#{pr_id}",
+            html_body=html,
+            text_body=body_md,
+        )
+
+    return {
+        "comment_posted": bool(result),
+        "comment_action": (result or {}).get("action"),
+        "inline_comments": {
+            "created": sum(r["status"] == "created" for r in inline_results),
+            "already_present": sum(r["status"] == "exists" for r in inline_results),
+            "failed": sum(r["status"] == "failed" for r in inline_results),
+            "not_posted": max(0, len(inline) - len(inline_results)),
+        },
+        "email_queued": emailed,
+        "incremental": bool(prior),
+        "diff_truncated": diff.truncated,
+        "commit": head_commit,
+        "review_id": review_id,
+    }
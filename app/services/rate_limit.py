@@ -0,0 +1,260 @@
+import asyncio
+import contextvars
+import json
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from ..config import (
+    LLM_RPM_LIMIT, LLM_TPM_LIMIT, LLM_RATE_LIMITS, WEB_CONCURRENCY,
+    LLM_MAX_RETRIES, LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN,
+)
+from ..utils.logger import logger
+
+T = TypeVar("T")
+
+# calls are queued fairly across these keys; the pipeline sets one per PR
+fair_key: contextvars.ContextVar[str] = contextvars.ContextVar("llm_fair_key", default="default")
+
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class ProviderUnavailable(Exception):
+    """The provider kept failing or its circuit is open; retry the work after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float = LLM_BREAKER_COOLDOWN):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute`; holds at most `burst` (default one minute's worth)."""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.capacity = float(per_minute if burst is None or not per_minute else burst)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.capacity:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def drain(self) -> None:
+        if self.capacity:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = time.monotonic()
+
+
+class ModelLimiter:
+    """
+    Requests- and tokens-per-minute budget for one model (or any upstream
+    with a request rate limit; pass tpm=0). Waiting calls are
+    served round-robin across fair keys, so one large PR cannot starve the
+    others queued behind it.
+    """
+
+    def __init__(self, rpm: float, tpm: float, burst: Optional[float] = None):
+        self.requests = TokenBucket(rpm, burst)
+        self.tokens = TokenBucket(tpm)
+        self._waiters: "OrderedDict[str, deque]" = OrderedDict()
+        self._pump: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+
+    async def acquire(self, key: str, tokens: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append((tokens, future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await future
+
+    def pause(self, seconds: float) -> None:
+        """After a 429 nobody sends for `seconds`, and the request budget starts from empty."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.requests.drain()
+
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def _run(self) -> None:
+        while self._waiters:
+            key, waiters = self._waiters.popitem(last=False)
+            tokens, future = waiters.popleft()
+            if waiters:
+                self._waiters[key] = waiters  # back of the line
+            while not future.done():
+                delay = max(
+                    self._paused_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(tokens),
+                )
+                if delay <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    future.set_result(None)
+                    break
+                await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for
+    `cooldown` seconds; then lets a single probe through and closes again
+    if it succeeds.
+    """
+
+    def __init__(self, name: str, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def check(self) -> None:
+        state = self.state
+        if state == "closed":
+            return
+        now = time.monotonic()
+        # a probe that never reported back (e.g. its job was cancelled) is replaced after a cooldown
+        if state == "half_open" and (self._probe_started is None or now - self._probe_started >= self.cooldown):
+            self._probe_started = now
+            return
+        remaining = max(1.0, self.opened_at + self.cooldown - now)
+        raise ProviderUnavailable(f"{self.name} circuit is open", retry_after=remaining)
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("%s circuit closed", self.name)
+        self.failures, self.opened_at, self._probe_started = 0, None, None
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._probe_started is not None or (self.opened_at is None and self.failures >= self.threshold):
+            logger.warning("%s circuit opened after %d failures", self.name, self.failures)
+            self.opened_at, self._probe_started = time.monotonic(), None
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def _model_limits(model: str) -> Dict[str, float]:
+    limits = {"rpm": LLM_RPM_LIMIT, "tpm": LLM_TPM_LIMIT}
+    try:
+        overrides = json.loads(LLM_RATE_LIMITS) if LLM_RATE_LIMITS else {}
+    except json.JSONDecodeError:
+        logger.error("LLM_RATE_LIMITS is not valid JSON; using LLM_RPM_LIMIT / LLM_TPM_LIMIT")
+        overrides = {}
+    limits.update(overrides.get(model, {}))
+    share = max(1, WEB_CONCURRENCY)
+    return {name: value / share for name, value in limits.items()}
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    if model not in _limiters:
+        limits = _model_limits(model)
+        _limiters[model] = ModelLimiter(limits["rpm"], limits["tpm"])
+    return _limiters[model]
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider)
+    return _breakers[provider]
+
+
+def _status(exc: Exception) -> Optional[int]:
+    # openai errors carry status_code, google.api_core errors carry code
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_transient(exc: Exception) -> bool:
+    status = _status(exc)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    name = type(exc).__name__
+    return isinstance(exc, (asyncio.TimeoutError, ConnectionError)) or "Timeout" in name or "Connection" in name
+
+
+async def call_with_limits(provider: str, model: str, tokens: int, call: Callable[[], Awaitable[T]]) -> T:
+    """
+    Run `call` within the model's rate limits and the provider's circuit
+    breaker. 429s, 5xx and connection errors are retried with jittered
+    backoff; once retries run out, or while the circuit is open,
+    ProviderUnavailable is raised so the caller can defer the job.
+    Other errors (bad request, auth) are raised as they are.
+    """
+    limiter, breaker = get_limiter(model), get_breaker(provider)
+    attempt = 0
+    while True:
+        breaker.check()
+        await limiter.acquire(fair_key.get(), tokens)
+        try:
+            result = await call()
+        except Exception as e:
+            if not _is_transient(e):
+                breaker.success()  # the provider answered; the request itself was bad
+                raise
+            breaker.failure()
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+            if _status(e) == 429:
+                limiter.pause(delay)
+            if attempt >= LLM_MAX_RETRIES:
+                raise ProviderUnavailable(f"{provider} {model} failed after {attempt + 1} attempts: {e}") from e
+            logger.warning(
+                "%s %s call failed (%s); retry %d/%d in %.1fs", provider, model, e, attempt + 1, LLM_MAX_RETRIES, delay
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.success()
+        return result
+
+
+def stats() -> dict:
+    return {
+        "models": {
+            model: {
+                "queued": limiter.queued(),
+                "rpm_available": round(limiter.requests.tokens, 1),
+                "tpm_available": round(limiter.tokens.tokens, 1),
+            }
+            for model, limiter in _limiters.items()
+        },
+        "breakers": {name: {"state": b.state, "failures": b.failures} for name, b in _breakers.items()},
+    }
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from ..config import (
+    REVIEW_CACHE_SIZE, REVIEW_CACHE_TTL, REVIEW_CACHE_DISK, REVIEW_CACHE_DISK_MAX_ENTRIES
+)
+from ..utils.db import connect
+from ..utils.logger import logger
+from ..utils.metrics import CACHE_LOOKUPS
+
+
+def normalize_chunk(chunk: str) -> str:
+    """
+    Drop parts of a diff chunk that change between pushes without changing
+    the reviewed code: blob hashes on `index` lines, CRLF and trailing spaces.
+    """
+    lines = []
+    for line in chunk.replace("\r\n", "\n").split("\n"):
+        if line.startswith("index "):
+            continue
+        lines.append(line.rstrip())
+    return "\n".join(lines).strip("\n")
+
+
+def cache_key(model: str, prompt_version: str, chunk: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, normalize_chunk(chunk)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ReviewCache:
+    """
+    Two-tier cache of per-chunk review results: an in-memory LRU in front of an
+    optional SQLite table. Both tiers expire entries after `ttl` seconds and
+    the disk tier is trimmed to `disk_max_entries` by last access.
+    """
+
+    def __init__(self, max_entries: int, ttl: int, disk: bool = False, disk_max_entries: int = 50000):
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._disk_max_entries = disk_max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._conn = None
+        if disk:
+            self._conn = connect()
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS review_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS review_cache_accessed ON review_cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[1] > now:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                CACHE_LOOKUPS.labels("memory_hit").inc()
+                return entry[0]
+            if entry:
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM review_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE review_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    value = json.loads(row["value"])
+                    self._remember(key, value, row["expires_at"])
+                    self.hits["disk"] += 1
+                    CACHE_LOOKUPS.labels("disk_hit").inc()
+                    return value
+
+            self.misses += 1
+            CACHE_LOOKUPS.labels("miss").inc()
+            return None
+
+    def set(self, key: str, value: dict) -> None:
+        now = time.time()
+        expires_at = now + self._ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO review_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict_disk(now)
+
+    def stats(self) -> dict:
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._conn is not None,
+        }
+
+    def _remember(self, key: str, value: dict, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float) -> None:
+        expired = self._conn.execute("DELETE FROM review_cache WHERE expires_at <= ?", (now,)).rowcount
+        overflow = self._conn.execute(
+            "DELETE FROM review_cache WHERE key IN ("
+            "SELECT key FROM review_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self._disk_max_entries,),
+        ).rowcount
+        if expired or overflow:
+            logger.info("Review cache evicted %d expired and %d overflow entries", expired, overflow)
+
+
+review_cache = ReviewCache(
+    max_entries=REVIEW_CACHE_SIZE,
+    ttl=REVIEW_CACHE_TTL,
+    disk=REVIEW_CACHE_DISK,
+    disk_max_entries=REVIEW_CACHE_DISK_MAX_ENTRIES,
+)
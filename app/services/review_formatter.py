@@ -1,3 +1,9 @@
+from collections import Counter
+
+MAX_SKIPPED_LISTED = 50
+INLINE_CATEGORY_LABELS = {"must_do": "Must Do", "good_to_have": "Good To Have", "security": "Security"}
+
+
 def format_review(sections: dict) -> str:
     parts = []
     title = sections.get("title", "🤖 AI Code Review")
@@ -33,6 +39,34 @@ def format_review(sections: dict) -> str:
         for i, good in enumerate(sections["good_to_have"], 1):
             parts.append(f"{i}. {good}")
         parts.append("")
+    if sections.get("inline_posted"):
+        # the findings themselves are on the diff; the summary only counts them
+        posted = sections["inline_posted"]
+        counts = Counter(c.get("category") for c in posted)
+        breakdown = ", ".join(
+            f"{label}: {counts[category]}" for category, label in INLINE_CATEGORY_LABELS.items() if counts[category]
+        )
+        files = len({c["path"] for c in posted})
+        parts.append(f"**Inline Comments**\n{len(posted)} on {files} file(s) ({breakdown})\n")
+    if sections.get("inline_comments"):
+        parts.append("**Line Comments**")
+        for c in sections["inline_comments"]:
+            label = INLINE_CATEGORY_LABELS.get(c.get("category"))
+            parts.append(f"- `{c['path']}:{c['line']}` {f'({label}) ' if label else ''}{c['message']}")
+        parts.append("")
+    if sections.get("skipped_files"):
+        skipped = sections["skipped_files"]
+        parts.append("**Skipped Files**")
+        for item in skipped[:MAX_SKIPPED_LISTED]:
+            parts.append(f"- `{item['path']}` ({item['reason']})")
+        if len(skipped) > MAX_SKIPPED_LISTED:
+            parts.append(f"- ...and {len(skipped) - MAX_SKIPPED_LISTED} more")
+        parts.append("")
+    if sections.get("notes"):
+        parts.append("**Notes**")
+        for note in sections["notes"]:
+            parts.append(f"- {note}")
+        parts.append("")
     if "final_thoughts" in sections:
         parts.append(f"**Final Thoughts**\n{sections['final_thoughts']}\n")
     return "\n".join(parts)
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from typing import Optional
+from ..utils.db import connect
+from ..utils.finding_dedup import dedupe_findings
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect()
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS pr_review_state ("
+            "repo_slug TEXT NOT NULL, pr_id INTEGER NOT NULL, commit_hash TEXT NOT NULL, "
+            "sections TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (repo_slug, pr_id))"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS pr_latest_revision ("
+            "repo_slug TEXT NOT NULL, pr_id INTEGER NOT NULL, commit_hash TEXT NOT NULL, "
+            "pushed_at TEXT NOT NULL, PRIMARY KEY (repo_slug, pr_id))"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS pr_comment ("
+            "repo_slug TEXT NOT NULL, pr_id INTEGER NOT NULL, comment_id INTEGER NOT NULL, "
+            "body_hash TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (repo_slug, pr_id))"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS pr_inline_comment ("
+            "repo_slug TEXT NOT NULL, pr_id INTEGER NOT NULL, key TEXT NOT NULL, comment_id INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (repo_slug, pr_id, key))"
+        )
+    return _conn
+
+
+def get_review_state(repo_slug: str, pr_id: int) -> Optional[dict]:
+    """Last reviewed source commit and its findings for a PR, if any."""
+    with _lock:
+        row = _db().execute(
+            "SELECT commit_hash, sections, updated_at FROM pr_review_state WHERE repo_slug = ? AND pr_id = ?",
+            (repo_slug, pr_id),
+        ).fetchone()
+    if not row:
+        return None
+    return {"commit": row["commit_hash"], "sections": json.loads(row["sections"]), "updated_at": row["updated_at"]}
+
+
+def save_review_state(repo_slug: str, pr_id: int, commit: str, sections: dict) -> None:
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO pr_review_state (repo_slug, pr_id, commit_hash, sections, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (repo_slug, pr_id, commit, json.dumps(sections), time.time()),
+        )
+
+
+def set_latest_revision(repo_slug: str, pr_id: int, commit: str, pushed_at: str = "") -> None:
+    """
+    Record the newest known head of a PR. `pushed_at` is the payload's ISO
+    `updated_on`; an out-of-order redelivery of an older event is ignored.
+    """
+    with _lock:
+        _db().execute(
+            "INSERT INTO pr_latest_revision (repo_slug, pr_id, commit_hash, pushed_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(repo_slug, pr_id) DO UPDATE SET commit_hash = excluded.commit_hash, "
+            "pushed_at = excluded.pushed_at WHERE excluded.pushed_at >= pr_latest_revision.pushed_at",
+            (repo_slug, pr_id, commit, pushed_at or ""),
+        )
+
+
+def get_latest_revision(repo_slug: str, pr_id: int) -> Optional[str]:
+    with _lock:
+        row = _db().execute(
+            "SELECT commit_hash FROM pr_latest_revision WHERE repo_slug = ? AND pr_id = ?", (repo_slug, pr_id)
+        ).fetchone()
+    return row["commit_hash"] if row else None
+
+
+def get_pr_comment(repo_slug: str, pr_id: int) -> Optional[dict]:
+    """Id and body hash of the review comment last posted on a PR, if any."""
+    with _lock:
+        row = _db().execute(
+            "SELECT comment_id, body_hash FROM pr_comment WHERE repo_slug = ? AND pr_id = ?", (repo_slug, pr_id)
+        ).fetchone()
+    return {"id": row["comment_id"], "body_hash": row["body_hash"]} if row else None
+
+
+def save_pr_comment(repo_slug: str, pr_id: int, comment_id: int, body_hash: str) -> None:
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO pr_comment (repo_slug, pr_id, comment_id, body_hash, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (repo_slug, pr_id, comment_id, body_hash, time.time()),
+        )
+
+
+def get_inline_comment(repo_slug: str, pr_id: int, key: str) -> Optional[int]:
+    """Id of the inline comment already posted on a PR under this idempotency key."""
+    with _lock:
+        row = _db().execute(
+            "SELECT comment_id FROM pr_inline_comment WHERE repo_slug = ? AND pr_id = ? AND key = ?",
+            (repo_slug, pr_id, key),
+        ).fetchone()
+    return row["comment_id"] if row else None
+
+
+def save_inline_comment(repo_slug: str, pr_id: int, key: str, comment_id: int) -> None:
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO pr_inline_comment (repo_slug, pr_id, key, comment_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (repo_slug, pr_id, key, comment_id, time.time()),
+        )
+
+
+def merge_sections(prior: dict, new: dict) -> dict:
+    """
+    Combine findings of an incremental review with the stored findings of the
+    previous revision. The new review wins for summary, effort and flags.
+    """
+    merged = dict(new)
+    for category in ("must_do", "good_to_have", "security"):
+        merged[category] = dedupe_findings(list(new.get(category, [])) + list(prior.get(category, [])))
+    # inline comments are anchored to the new revision's lines; only the new review's are kept
+    merged["inline_comments"] = list(new.get("inline_comments", []))
+    return merged
@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+from typing import List, Optional, Tuple
+from ..utils.db import connect
+
+_conn = None
+_lock = threading.Lock()
+
+# columns returned by list_reviews() unless sections are asked for
+SUMMARY_COLUMNS = "id, repo_slug, pr_id, commit_hash, model, incremental, created_at"
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect()
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, repo_slug TEXT NOT NULL, pr_id INTEGER NOT NULL, "
+            "commit_hash TEXT NOT NULL, model TEXT NOT NULL, incremental INTEGER NOT NULL, "
+            "sections TEXT NOT NULL, created_at REAL NOT NULL, UNIQUE (repo_slug, pr_id, commit_hash))"
+        )
+        # listings page newest-first by id, so id is the last column of each filter index
+        _conn.execute("CREATE INDEX IF NOT EXISTS reviews_repo ON reviews (repo_slug, id)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS reviews_repo_pr ON reviews (repo_slug, pr_id, id)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS reviews_commit ON reviews (commit_hash)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS reviews_created ON reviews (created_at)")
+    return _conn
+
+
+def _row(row, with_sections: bool = True) -> dict:
+    review = {
+        "id": row["id"],
+        "repo_slug": row["repo_slug"],
+        "pr_id": row["pr_id"],
+        "commit": row["commit_hash"] or None,
+        "model": row["model"],
+        "incremental": bool(row["incremental"]),
+        "created_at": row["created_at"],
+    }
+    if with_sections:
+        review["sections"] = json.loads(row["sections"])
+    return review
+
+
+def save_review(repo_slug: str, pr_id: int, commit: Optional[str], sections: dict,
+                model: str = "", incremental: bool = False) -> int:
+    """
+    Store the structured review of one PR revision and return its id.
+    Reviewing the same commit again replaces the stored sections and keeps the id.
+    """
+    with _lock:
+        conn = _db()
+        conn.execute(
+            "INSERT INTO reviews (repo_slug, pr_id, commit_hash, model, incremental, sections, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(repo_slug, pr_id, commit_hash) DO UPDATE SET "
+            "model = excluded.model, incremental = excluded.incremental, sections = excluded.sections, "
+            "created_at = excluded.created_at",
+            (repo_slug, pr_id, commit or "", model, int(incremental), json.dumps(sections), time.time()),
+        )
+        row = conn.execute(
+            "SELECT id FROM reviews WHERE repo_slug = ? AND pr_id = ? AND commit_hash = ?",
+            (repo_slug, pr_id, commit or ""),
+        ).fetchone()
+    return row["id"]
+
+
+def get_review(review_id: int) -> Optional[dict]:
+    with _lock:
+        row = _db().execute("SELECT * FROM reviews WHERE id = ?", (review_id,)).fetchone()
+    return _row(row) if row else None
+
+
+def list_reviews(
+    repo_slug: Optional[str] = None,
+    pr_id: Optional[int] = None,
+    commit: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    before_id: Optional[int] = None,
+    limit: int = 20,
+    with_sections: bool = False,
+) -> Tuple[List[dict], Optional[int]]:
+    """
+    Newest-first page of reviews matching the filters, plus the cursor for
+    the next page (pass it back as `before_id`), or None on the last page.
+    Keyset pagination keeps every page an index range scan.
+    """
+    where, params = [], []
+    for column, value in (("repo_slug", repo_slug), ("pr_id", pr_id), ("commit_hash", commit)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("created_at < ?")
+        params.append(until)
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    columns = "*" if with_sections else SUMMARY_COLUMNS
+    sql = f"SELECT {columns} FROM reviews"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
+    # one extra row tells whether there is a next page
+    params.append(limit + 1)
+    with _lock:
+        rows = _db().execute(sql, params).fetchall()
+    items = [_row(row, with_sections) for row in rows[:limit]]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+    return items, next_cursor
@@ -1,4 +1,8 @@
-from typing import List
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
+from .diff_parser import HUNK_RE, DiffFile, Hunk, iter_lines, parse_diff, split_hunk
+
+# width of the new-file line number column added by number_chunk()
+LINE_NUMBER_WIDTH = 6
 
 def chunk_text(text: str, chunk_size: int) -> List[str]:
     if not text:
@@ -12,3 +16,115 @@ def chunk_text(text: str, chunk_size: int) -> List[str]:
         chunks.append(chunk)
         start = end
     return chunks
+
+
+class _Bin:
+    def __init__(self):
+        self.size = 0
+        self.files = {}  # file index -> (DiffFile, [hunks]) in insertion order
+
+    def cost(self, file_index: int, header_size: int, unit_size: int) -> int:
+        return unit_size + (0 if file_index in self.files else header_size)
+
+    def add(self, file_index: int, diff_file: DiffFile, hunk, cost: int) -> None:
+        entry = self.files.setdefault(file_index, (diff_file, []))
+        if hunk is not None:
+            entry[1].append(hunk)
+        self.size += cost
+
+    def render(self) -> str:
+        parts = []
+        for file_index in sorted(self.files):
+            diff_file, hunks = self.files[file_index]
+            parts.append(diff_file.header_text)
+            parts.extend(h.text for h in hunks)
+        return "".join(parts)
+
+
+def chunk_diff(
+    diff: Union[str, Iterable[str]],
+    chunk_size: int,
+    size_fn: Callable[[str], int] = len,
+) -> List[str]:
+    """
+    Split a unified diff on file and hunk boundaries and pack the hunks into
+    chunks of at most `chunk_size` (measured with `size_fn`) using first-fit.
+    Every chunk repeats the `diff --git` header of each file it contains, and
+    hunks too big for one chunk are split with recomputed `@@` headers.
+    Accepts the diff text or any iterable of lines.
+    """
+    lines = iter_lines(diff) if isinstance(diff, str) else diff
+    return pack_files(parse_diff(lines), chunk_size, size_fn)
+
+
+def pack_files(
+    files: Iterable[DiffFile],
+    chunk_size: int,
+    size_fn: Callable[[str], int] = len,
+) -> List[str]:
+    """Pack already parsed (and possibly filtered/reordered) files into chunks; see chunk_diff."""
+    bins: List[_Bin] = []
+    open_bins: List[_Bin] = []
+    # bins with less than this much room left stop being scanned by first-fit
+    min_room = chunk_size // 20
+
+    def place(file_index: int, diff_file: DiffFile, hunk, header_size: int, unit_size: int):
+        for b in open_bins:
+            cost = b.cost(file_index, header_size, unit_size)
+            if b.size + cost <= chunk_size:
+                b.add(file_index, diff_file, hunk, cost)
+                if chunk_size - b.size < min_room:
+                    open_bins.remove(b)
+                return
+        b = _Bin()
+        b.add(file_index, diff_file, hunk, header_size + unit_size)
+        bins.append(b)
+        if chunk_size - b.size >= min_room:
+            open_bins.append(b)
+
+    for file_index, diff_file in enumerate(files):
+        header_size = size_fn(diff_file.header_text)
+        if not diff_file.hunks:
+            place(file_index, diff_file, None, header_size, 0)
+            continue
+        budget = max(1, chunk_size - header_size)
+        for hunk in diff_file.hunks:
+            hunk_size = size_fn(hunk.text)
+            pieces = [hunk] if hunk_size <= budget else split_hunk(hunk, max(1, budget - size_fn(hunk.header)), size_fn)
+            for piece in pieces:
+                piece_size = hunk_size if piece is hunk else size_fn(piece.text)
+                if piece_size > budget:
+                    # a single line longer than a chunk (minified code); hard-split it
+                    for part in chunk_text(piece.text, budget):
+                        place(file_index, diff_file, Hunk(header="", lines=[part]), header_size, size_fn(part))
+                else:
+                    place(file_index, diff_file, piece, header_size, piece_size)
+
+    return [b.render() for b in bins if b.files]
+
+
+def number_chunk(chunk: str) -> Tuple[str, Dict[str, Set[int]]]:
+    """
+    Prefix each added and context line of a chunk with its line number in
+    the new file, so findings can cite real file lines, and return the line
+    map {path: new-file lines present in the chunk} used to check them.
+    Removed lines and lines outside a hunk get a blank number column.
+    """
+    blank = " " * LINE_NUMBER_WIDTH
+    parts: List[str] = []
+    line_map: Dict[str, Set[int]] = {}
+    for diff_file in parse_diff(iter_lines(chunk)):
+        parts.append(diff_file.header_text)
+        numbers = line_map.setdefault(diff_file.path, set()) if diff_file.path else set()
+        for hunk in diff_file.hunks:
+            parts.append(hunk.header)
+            match = HUNK_RE.match(hunk.header.rstrip("\n"))
+            new_line = int(match.group(3)) if match else None
+            for line in hunk.lines:
+                if new_line is None or line[:1] in ("-", "\\"):
+                    parts.append(f"{blank} {line}")
+                    continue
+                parts.append(f"{new_line:>{LINE_NUMBER_WIDTH}} {line}")
+                numbers.add(new_line)
+                new_line += 1
+    return "".join(parts), {path: lines for path, lines in line_map.items() if lines}
@@ -0,0 +1,18 @@
+import os
+import sqlite3
+from ..config import STATE_DB_PATH
+
+
+def connect(path: str = STATE_DB_PATH) -> sqlite3.Connection:
+    """
+    Open the shared state database in autocommit mode.
+    WAL lets several uvicorn workers read while one of them writes.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,120 @@
+import json
+import posixpath
+import re
+from fnmatch import fnmatch
+from typing import Callable, Dict, Iterable, List, Tuple
+from ..config import DIFF_EXCLUDE_PATTERNS, DIFF_FILTER_RULES, MAX_FILE_DIFF_BYTES, REVIEW_TOKEN_BUDGET
+from .diff_parser import DiffFile
+from .logger import logger
+
+GENERATED_MARKERS = ("@generated", "do not edit", "code generated by", "autogenerated", "auto-generated")
+# added lines longer than this on average are treated as minified/bundled output
+MINIFIED_AVG_LINE = 500
+
+# lower tier is reviewed first when the token budget runs out
+TIER_SOURCE, TIER_CONFIG, TIER_TESTS, TIER_DOCS = 0, 1, 2, 3
+DOC_EXTENSIONS = {".md", ".rst", ".txt", ".adoc"}
+CONFIG_EXTENSIONS = {".json", ".yaml", ".yml", ".toml", ".ini", ".cfg", ".xml", ".properties", ".env"}
+
+
+def _repo_rules(repo_slug: str) -> Dict[str, List[str]]:
+    try:
+        rules = json.loads(DIFF_FILTER_RULES) if DIFF_FILTER_RULES else {}
+    except json.JSONDecodeError:
+        logger.error("DIFF_FILTER_RULES is not valid JSON; ignoring per-repo rules")
+        return {}
+    return rules.get(repo_slug) or rules.get("*") or {}
+
+
+def matches(path: str, pattern: str) -> bool:
+    """
+    `regex:<expr>` is searched in the path. Globs containing '/' match the
+    path at any depth; other globs match the file name.
+    """
+    if pattern.startswith("regex:"):
+        return re.search(pattern[6:], path) is not None
+    if "/" in pattern:
+        return fnmatch(path, pattern) or fnmatch(path, "*/" + pattern)
+    return fnmatch(posixpath.basename(path), pattern)
+
+
+def _skip_reason(diff_file: DiffFile, exclude: List[str], include: List[str]) -> str:
+    path = diff_file.path
+    if any(matches(path, p) for p in include):
+        return ""
+    for pattern in exclude:
+        if matches(path, pattern):
+            return f"matches {pattern}"
+    if any(line.startswith(("Binary files ", "GIT binary patch")) for line in diff_file.header):
+        return "binary"
+    size = diff_file.size
+    if MAX_FILE_DIFF_BYTES and size > MAX_FILE_DIFF_BYTES:
+        return f"diff too large ({size} bytes)"
+
+    added = [line for hunk in diff_file.hunks for line in hunk.lines if line.startswith("+")]
+    head = "".join(added[:10]).lower()
+    if any(marker in head for marker in GENERATED_MARKERS):
+        return "generated"
+    if added and sum(len(line) for line in added) / len(added) > MINIFIED_AVG_LINE:
+        return "minified"
+    return ""
+
+
+def priority_tier(path: str) -> int:
+    lower = path.lower()
+    name = posixpath.basename(lower)
+    ext = posixpath.splitext(name)[1]
+    if ext in DOC_EXTENSIONS or lower.startswith("docs/") or "/docs/" in lower:
+        return TIER_DOCS
+    if (
+        name.startswith("test_") or name.endswith(("_test.py", "_test.go", "_spec.rb"))
+        or ".test." in name or ".spec." in name
+        or re.search(r"(^|/)(tests?|__tests__|spec)/", lower)
+    ):
+        return TIER_TESTS
+    if ext in CONFIG_EXTENSIONS or name in ("dockerfile", "makefile") or lower.startswith(".github/"):
+        return TIER_CONFIG
+    return TIER_SOURCE
+
+
+def select_files(
+    files: Iterable[DiffFile],
+    repo_slug: str = "",
+    size_fn: Callable[[str], int] = len,
+    token_budget: int = REVIEW_TOKEN_BUDGET,
+) -> Tuple[List[DiffFile], List[dict]]:
+    """
+    Filter out files that should not reach the LLM and order the rest by
+    review priority (source, config, tests, docs; diff order within a tier).
+    With a token budget, lower-priority files past the budget are skipped.
+    Returns (files to review, [{"path", "reason"}, ...] for skipped files).
+    """
+    rules = _repo_rules(repo_slug)
+    exclude = list(DIFF_EXCLUDE_PATTERNS) + list(rules.get("exclude", []))
+    include = list(rules.get("include", []))
+
+    kept: List[DiffFile] = []
+    skipped: List[dict] = []
+    for diff_file in files:
+        reason = _skip_reason(diff_file, exclude, include)
+        if reason:
+            skipped.append({"path": diff_file.path, "reason": reason})
+        else:
+            kept.append(diff_file)
+
+    kept.sort(key=lambda f: priority_tier(f.path))
+
+    if token_budget:
+        selected, used = [], 0
+        for diff_file in kept:
+            tokens = size_fn(diff_file.text)
+            if used + tokens > token_budget:
+                skipped.append({"path": diff_file.path, "reason": "review token budget exhausted"})
+                continue
+            selected.append(diff_file)
+            used += tokens
+        kept = selected
+
+    if skipped:
+        logger.info("Skipping %d of %d files before review", len(skipped), len(kept) + len(skipped))
+    return kept, skipped
@@ -0,0 +1,149 @@
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional
+
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$")
+
+
+@dataclass
+class Hunk:
+    header: str
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return self.header + "".join(self.lines)
+
+
+@dataclass
+class DiffFile:
+    header: List[str] = field(default_factory=list)
+    hunks: List[Hunk] = field(default_factory=list)
+
+    @property
+    def header_text(self) -> str:
+        return "".join(self.header)
+
+    @property
+    def text(self) -> str:
+        return self.header_text + "".join(h.text for h in self.hunks)
+
+    @property
+    def size(self) -> int:
+        """Length of the file's diff text, without building it."""
+        return (
+            sum(len(line) for line in self.header)
+            + sum(len(h.header) + sum(len(line) for line in h.lines) for h in self.hunks)
+        )
+
+    @property
+    def path(self) -> str:
+        """New path of the file ('+++ b/...'), falling back to the old path and the git header."""
+        old_path = None
+        for line in self.header:
+            if line.startswith("+++ "):
+                path = _strip_prefix(line[4:])
+                if path:
+                    return path
+            elif line.startswith("--- "):
+                old_path = _strip_prefix(line[4:])
+        if old_path:
+            return old_path
+        if self.header and self.header[0].startswith("diff --git "):
+            parts = self.header[0].rstrip("\n").split(" b/", 1)
+            if len(parts) == 2:
+                return parts[1]
+        return ""
+
+
+def _strip_prefix(path: str) -> Optional[str]:
+    path = path.rstrip("\n").split("\t", 1)[0]
+    if path == "/dev/null":
+        return None
+    if path.startswith(("a/", "b/")):
+        return path[2:]
+    return path
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Yield lines (with their newline) without building a list copy of the text."""
+    start, n = 0, len(text)
+    while start < n:
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end + 1]
+        start = end + 1
+
+
+def parse_diff(lines: Iterable[str]) -> Iterator[DiffFile]:
+    """
+    Stream a unified diff and yield one DiffFile per `diff --git` section.
+    Text before the first file header is yielded as a header-only DiffFile.
+    """
+    current: Optional[DiffFile] = None
+    hunk: Optional[Hunk] = None
+
+    for line in lines:
+        if line.startswith("diff --git "):
+            if current is not None:
+                yield current
+            current, hunk = DiffFile(header=[line]), None
+            continue
+        if current is None:
+            current = DiffFile()
+        if line.startswith("@@") and HUNK_RE.match(line.rstrip("\n")):
+            hunk = Hunk(header=line)
+            current.hunks.append(hunk)
+        elif hunk is None:
+            current.header.append(line)
+        else:
+            hunk.lines.append(line)
+
+    if current is not None:
+        yield current
+
+
+def split_hunk(hunk: Hunk, max_size: int, size_fn=len) -> List[Hunk]:
+    """
+    Split an oversized hunk at line boundaries. Every piece gets its own
+    `@@ -a,b +c,d @@` header with line numbers recomputed for that piece.
+    """
+    match = HUNK_RE.match(hunk.header.rstrip("\n"))
+    if not match:
+        return [hunk]
+    old_line, new_line = int(match.group(1)), int(match.group(3))
+    section = match.group(5)
+
+    pieces: List[Hunk] = []
+    piece_lines: List[str] = []
+    piece_size = 0
+    start_old, start_new = old_line, new_line
+    old_count = new_count = 0
+
+    def close():
+        header = f"@@ -{start_old},{old_count} +{start_new},{new_count} @@{section}\n"
+        pieces.append(Hunk(header=header, lines=piece_lines))
+
+    for line in hunk.lines:
+        line_size = size_fn(line)
+        if piece_lines and piece_size + line_size > max_size:
+            close()
+            piece_lines, piece_size = [], 0
+            start_old, start_new = start_old + old_count, start_new + new_count
+            old_count = new_count = 0
+        piece_lines.append(line)
+        piece_size += line_size
+        marker = line[:1]
+        if marker == "-":
+            old_count += 1
+        elif marker == "+":
+            new_count += 1
+        elif marker != "\\":
+            old_count += 1
+            new_count += 1
+
+    if piece_lines:
+        close()
+    return pieces
@@ -0,0 +1,141 @@
+import re
+import zlib
+from typing import TYPE_CHECKING, List
+from ..config import FINDING_SIMILARITY_THRESHOLD
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# "Line 42", "lines 10-12", "L42"
+LINE_REF_RE = re.compile(r"\b(?:lines?\s+\d+(?:\s*[-–]\s*\d+)?|L\d+)\b", re.IGNORECASE)
+WORD_RE = re.compile(r"[a-z0-9_]+")
+# "`src/app.py` line 42: ..." as written for findings that are not posted inline
+PATH_RE = re.compile(r"`[^`\n]+`")
+# `code`, snake_case, dotted.names and camelCase, or the word after "import", "variable", ...
+IDENT_RE = re.compile(
+    r"`([^`\n]+)`|\b(\w+(?:[_.]\w+)+|[a-z]+[A-Z]\w*)\b"
+    r"|\b(?i:import|variable|function|method|class|parameter|argument|attribute|field)\s+([A-Za-z_]\w*)"
+)
+STOPWORDS = frozenset("a an the to of for in on at by is are be this that it and or with from".split())
+# hashed feature space; keeps the matrix at n x DIMENSIONS regardless of vocabulary size
+DIMENSIONS = 1024
+# line references appended to a merged finding before summarizing the rest as "+N more"
+MAX_EXTRA_REFS = 10
+# rows of the similarity matrix computed at once, to bound memory for large n
+BLOCK_ROWS = 512
+
+
+def line_refs(text: str) -> List[str]:
+    return [m.group(0) for m in LINE_REF_RE.finditer(text)]
+
+
+def location_refs(text: str) -> List[str]:
+    """Line references qualified by the finding's leading `path`, if it has one."""
+    match = PATH_RE.match(text)
+    refs = line_refs(text)
+    if not match:
+        return refs
+    path = match.group(0)
+    return [f"{path} {ref}" for ref in refs] or [path]
+
+
+def _strip_path(text: str) -> str:
+    match = PATH_RE.match(text)
+    return text[match.end():] if match else text
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase, drop the leading `path`, line references and punctuation so
+    only the wording is compared; the same issue in two files can merge.
+    """
+    return " ".join(WORD_RE.findall(LINE_REF_RE.sub(" ", _strip_path(text).lower())))
+
+
+def identifiers(text: str) -> frozenset:
+    """Names a finding is about; findings naming different ones are never merged."""
+    names = set()
+    for match in IDENT_RE.finditer(_strip_path(text)):
+        name = next(group for group in match.groups() if group)
+        if name.lower() not in STOPWORDS:
+            names.add(name.lower())
+    return frozenset(names)
+
+
+def _features(text: str) -> List[int]:
+    words = [w for w in normalize(text).split() if w not in STOPWORDS]
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return [zlib.crc32(g.encode("utf-8")) % DIMENSIONS for g in grams]
+
+
+def _tfidf(items: List[str]) -> "np.ndarray":
+    import numpy as np
+
+    matrix = np.zeros((len(items), DIMENSIONS), dtype=np.float32)
+    for row, item in enumerate(items):
+        np.add.at(matrix[row], _features(item), 1.0)
+    df = np.count_nonzero(matrix, axis=0)
+    idf = np.log((1 + len(items)) / (1 + df)).astype(np.float32) + 1.0
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cluster(items: List[str], threshold: float = FINDING_SIMILARITY_THRESHOLD) -> List[List[int]]:
+    """
+    Group near-duplicate items by TF-IDF cosine similarity over word uni/bigrams.
+    Greedy: each unassigned item, in order, claims every unassigned item at
+    or above the threshold that names the same identifiers.
+    Returns index lists in order of first member.
+    """
+    n = len(items)
+    if n == 0:
+        return []
+    # numpy is imported on first use so it stays off the startup path
+    import numpy as np
+
+    matrix = _tfidf(items)
+    names = [identifiers(item) for item in items]
+    assigned = np.zeros(n, dtype=bool)
+    clusters = []
+    for start in range(0, n, BLOCK_ROWS):
+        sims = matrix[start:start + BLOCK_ROWS] @ matrix.T
+        for offset, row in enumerate(sims):
+            i = start + offset
+            if assigned[i]:
+                continue
+            members = [
+                int(m) for m in np.flatnonzero((row >= threshold) & ~assigned)
+                if names[m] == names[i]
+            ]
+            if i not in members:
+                # an item with no words has a zero vector; keep it on its own
+                members.append(i)
+            assigned[members] = True
+            clusters.append(sorted(members))
+    return clusters
+
+
+def dedupe_findings(items: List[str], threshold: float = FINDING_SIMILARITY_THRESHOLD) -> List[str]:
+    """
+    Collapse near-duplicate findings into one, keeping the most detailed
+    wording and appending line references that only other members had.
+    """
+    items = list(dict.fromkeys(str(item) for item in items if str(item).strip()))
+    result = []
+    for members in cluster(items, threshold):
+        texts = [items[m] for m in members]
+        best = max(texts, key=len)
+        # refs keep their file, so a merged finding never points at the wrong one
+        seen = {ref.lower() for ref in location_refs(best)}
+        extra = []
+        for text in texts:
+            for ref in location_refs(text):
+                if ref.lower() not in seen:
+                    seen.add(ref.lower())
+                    extra.append(ref)
+        if len(extra) > MAX_EXTRA_REFS:
+            extra = extra[:MAX_EXTRA_REFS] + [f"+{len(extra) - MAX_EXTRA_REFS} more"]
+        result.append(f"{best} (also: {', '.join(extra)})" if extra else best)
+    return result
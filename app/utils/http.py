@@ -0,0 +1,141 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from ..config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX
+)
+from .logger import logger
+from .metrics import HTTP_SECONDS
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_stats: Dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    One keep-alive session per host. pool_block caps concurrent connections
+    to a host at HTTP_POOL_MAXSIZE instead of opening throwaway ones.
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, pool_block=True)
+            session.mount(host, adapter)
+            _sessions[host] = session
+        return session
+
+
+def _retry_after(resp: requests.Response) -> Optional[float]:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter: spreads retries from concurrent jobs instead of synchronizing them
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _record(host: str, method: str, elapsed: float, status: Optional[int]) -> None:
+    key = f"{method} {host}"
+    HTTP_SECONDS.labels(host, method).observe(elapsed)
+    with _stats_lock:
+        entry = _stats.setdefault(key, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        entry["calls"] += 1
+        entry["total_seconds"] += elapsed
+        entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+        if status is None or status >= 400:
+            entry["errors"] += 1
+
+
+def latency_stats() -> Dict[str, dict]:
+    with _stats_lock:
+        return {
+            key: dict(entry, avg_seconds=round(entry["total_seconds"] / entry["calls"], 4) if entry["calls"] else 0.0)
+            for key, entry in _stats.items()
+        }
+
+
+def request(
+    method: str,
+    url: str,
+    *,
+    retries: int = HTTP_MAX_RETRIES,
+    idempotent: Optional[bool] = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    requests.request() through the pooled session for the URL's host, with a
+    default timeout and jittered retries. 429s are always retried (the server
+    rejected the call); 5xx and connection errors only for idempotent calls,
+    so a POST that may have been applied is not sent twice. Pass
+    idempotent=True for read-only POSTs such as queries.
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    session = get_session(url)
+    host = urlsplit(url).netloc
+
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(host, method, time.perf_counter() - start, None)
+            if not idempotent or attempt >= retries:
+                raise
+            delay = _backoff(attempt)
+            logger.warning("%s %s failed (%s); retry %d/%d in %.1fs", method, host, e, attempt + 1, retries, delay)
+        else:
+            _record(host, method, time.perf_counter() - start, resp.status_code)
+            retryable = resp.status_code == 429 or (idempotent and resp.status_code in RETRY_STATUSES)
+            if not retryable or attempt >= retries:
+                return resp
+            delay = _retry_after(resp)
+            delay = _backoff(attempt) if delay is None else min(delay, HTTP_BACKOFF_MAX)
+            logger.warning(
+                "%s %s returned %d; retry %d/%d in %.1fs", method, host, resp.status_code, attempt + 1, retries, delay
+            )
+            resp.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request("PUT", url, **kwargs)
+
+
+def patch(url: str, **kwargs) -> requests.Response:
+    return request("PATCH", url, **kwargs)
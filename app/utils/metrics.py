@@ -0,0 +1,77 @@
+import asyncio
+import functools
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+from .logger import logger
+
+# seconds; covers a cache hit through a slow LLM consolidation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+STAGE_SECONDS = Histogram(
+    "ai_reviewer_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter("ai_reviewer_stage_errors_total", "Pipeline stages that raised", ["stage"])
+HTTP_SECONDS = Histogram(
+    "ai_reviewer_http_request_seconds", "Outbound HTTP request latency", ["host", "method"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "ai_reviewer_llm_tokens", "Tokens per LLM call", ["model", "kind"], buckets=TOKEN_BUCKETS
+)
+DIFF_BYTES = Histogram("ai_reviewer_diff_bytes", "Diff bytes read per review", buckets=BYTES_BUCKETS)
+CHUNKS = Histogram("ai_reviewer_review_chunks", "Diff chunks per review", buckets=COUNT_BUCKETS)
+CACHE_LOOKUPS = Counter("ai_reviewer_review_cache_lookups_total", "Chunk review cache lookups", ["result"])
+JOBS = Counter("ai_reviewer_jobs_total", "Background jobs by final status", ["kind", "status"])
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as `stage`; errors are counted and re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        logger.debug("%s took %.3fs", stage, elapsed)
+
+
+def timed(stage: str):
+    """Decorator form of span() for sync and async functions."""
+
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def render() -> tuple:
+    """
+    (body, content type) for /metrics. With several server processes set
+    PROMETHEUS_MULTIPROC_DIR so every worker's samples are aggregated.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
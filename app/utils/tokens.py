@@ -0,0 +1,83 @@
+import math
+from functools import lru_cache
+from typing import Optional
+from ..config import OPENAI_MODEL, CHUNK_CONTEXT_SHARE, MAX_TOKENS_PER_CHUNK
+from .logger import logger
+
+# Context window (input + output tokens) per model. Prefix matches are used
+# for dated variants, e.g. "gpt-4o-mini-2024-07-18" -> "gpt-4o-mini".
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128_000,
+    "gpt-4o": 128_000,
+    "gpt-4.1-nano": 1_047_576,
+    "gpt-4.1-mini": 1_047_576,
+    "gpt-4.1": 1_047_576,
+    "gpt-4-turbo": 128_000,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+    "o1": 200_000,
+    "o3-mini": 200_000,
+    "o3": 200_000,
+    "o4-mini": 200_000,
+    "gemini-pro": 32_760,
+    "gemini-1.5-flash": 1_048_576,
+    "gemini-1.5-pro": 2_097_152,
+    "gemini-2.0-flash": 1_048_576,
+}
+DEFAULT_CONTEXT_WINDOW = 8_192
+
+# average characters per token for source code, used when tiktoken is unavailable
+APPROX_CHARS_PER_TOKEN = 3.0
+
+
+def context_window(model: str = OPENAI_MODEL) -> int:
+    if model in MODEL_CONTEXT_WINDOWS:
+        return MODEL_CONTEXT_WINDOWS[model]
+    matches = [name for name in MODEL_CONTEXT_WINDOWS if model.startswith(name)]
+    if matches:
+        return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+@lru_cache(maxsize=16)
+def _encoder(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.info("tiktoken not installed; using approximate token counts")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # encodings are downloaded on first use and may be unreachable
+        logger.warning("Could not load tokenizer for %s (%s); using approximate token counts", model, e)
+        return None
+
+
+def approx_tokens(text: str) -> int:
+    return math.ceil(len(text) / APPROX_CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str, model: str = OPENAI_MODEL) -> int:
+    if not text:
+        return 0
+    enc = _encoder(model)
+    if enc is None:
+        return approx_tokens(text)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def prompt_budget(model: str = OPENAI_MODEL, reserved: int = 0, cap: Optional[int] = None) -> int:
+    """
+    Tokens available for variable prompt content: CHUNK_CONTEXT_SHARE of the
+    model's context window, minus `reserved` for the fixed prompt text, and
+    never more than `cap` (MAX_TOKENS_PER_CHUNK when set).
+    """
+    budget = int(context_window(model) * CHUNK_CONTEXT_SHARE) - reserved
+    cap = MAX_TOKENS_PER_CHUNK if cap is None else cap
+    if cap > 0:
+        budget = min(budget, cap)
+    return max(256, budget)
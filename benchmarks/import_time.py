@@ -0,0 +1,73 @@
+"""
+Check that importing the app stays within a startup budget.
+
+    python -m benchmarks.import_time --budget-ms 1500
+
+Runs `python -X importtime -c "import app.main"` in fresh interpreters,
+keeps the fastest run (the first one pays for a cold disk cache) and exits
+with code 1 if the import took longer than the budget or pulled in an SDK
+that should only load on first use. Prints the slowest top-level imports.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# imported lazily by the services that use them; seeing one at startup is a regression
+LAZY_MODULES = ("boto3", "botocore", "numpy", "openai", "google.generativeai", "tiktoken")
+LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure() -> Tuple[int, Dict[str, int], List[Tuple[int, str]]]:
+    """(total us for app.main, cumulative us by module, top-level imports as (us, name))."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    cumulative, children, top_level = {}, [], []
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if not m:
+            continue
+        us, indent, name = int(m.group(2)), len(m.group(3)), m.group(4)
+        cumulative[name] = us
+        # a module is printed after its imports, one level deeper than it
+        if indent == 3:
+            children.append((us, name))
+        elif indent == 1:
+            if name == "app.main":
+                top_level = children
+            children = []
+    return cumulative.get("app.main", 0), cumulative, top_level
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1500, help="max time to import app.main")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to measure; the fastest counts")
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to print")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(1, args.runs))]
+    total, cumulative, top_level = min(runs, key=lambda r: r[0])
+
+    print(f"import app.main: {total / 1000:.0f} ms (budget {args.budget_ms:.0f} ms, best of {len(runs)})")
+    for us, name in sorted(top_level, reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if total / 1000 > args.budget_ms:
+        failures.append(f"import took {total / 1000:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    eager = [m for m in LAZY_MODULES if m in cumulative]
+    if eager:
+        failures.append(f"imported at startup but should load on first use: {', '.join(eager)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
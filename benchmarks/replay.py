@@ -0,0 +1,321 @@
+"""
+Replay webhook payloads through the app against local upstream stand-ins
+and report throughput, latency percentiles, peak RSS and LLM calls.
+
+    python -m benchmarks.replay --prs 40 --sizes 10KB,1MB,10MB --merges 5
+    python -m benchmarks.replay --json after.json --baseline before.json
+
+The app runs as a real uvicorn process with Bitbucket, Notion, SES and the
+LLM pointed at benchmarks/stub_servers.py. A review's latency runs from the
+webhook POST until its job reaches a final status; merge webhooks are timed
+as a single request. Pass app settings with --env KEY=VALUE.
+"""
+import argparse
+import asyncio
+import copy
+import glob
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = os.path.join(ROOT, "tests", "sample-payload.json")
+FINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    for unit in ("GB", "MB", "KB", "B"):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * UNITS[unit])
+    return int(text)
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100.0 * len(ordered) + 0.5))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water RSS of a process (Linux /proc); None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def load_corpus(path: str) -> List[dict]:
+    files = sorted(glob.glob(os.path.join(path, "*.json"))) if os.path.isdir(path) else [path]
+    payloads = []
+    for name in files:
+        with open(name) as f:
+            payloads.append(json.load(f))
+    if not payloads:
+        raise SystemExit(f"No webhook payloads found in {path}")
+    return payloads
+
+
+def build_pr_payload(template: dict, index: int, size: int, stub: str) -> dict:
+    payload = copy.deepcopy(template)
+    pr = payload.setdefault("pullrequest", {})
+    repo = payload.setdefault("repository", {"slug": "repo"})
+    slug = repo.get("slug") or repo.get("name") or "repo"
+    pr_id = index + 1
+    pr["id"] = pr_id
+    pr.setdefault("author", {"display_name": "Bench Dev"})
+    pr["source"] = dict(pr.get("source") or {}, commit={"hash": hashlib.sha1(f"bench-{index}".encode()).hexdigest()})
+    pr["updated_on"] = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+    href = f"{stub}/bitbucket/repositories/bench/{slug}/pullrequests/{pr_id}/diff?size={size}&seed={pr_id}"
+    pr["links"] = dict(pr.get("links") or {}, diff={"href": href})
+    return payload
+
+
+def build_merge_payload(template: dict, index: int, stub: str) -> dict:
+    payload = build_pr_payload(template, 10000 + index, 20 * 1024, stub)
+    pr = payload["pullrequest"]
+    pr["title"] = f"Bench merge {index}"
+    pr["description"] = "Implements the epic requirements."
+    pr["source"]["branch"] = {"name": f"feature/EPIC-{index + 1}-bench"}
+    return payload
+
+
+def start(cmd: List[str], env: dict, log_path: str) -> subprocess.Popen:
+    with open(log_path, "w") as log:
+        return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{url} exited with {proc.returncode} before becoming ready")
+        try:
+            if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise SystemExit(f"{url} did not become ready in {timeout:.0f}s")
+
+
+async def replay(args, app_url: str, stub_url: str, corpus: List[dict]) -> Dict:
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    limit = asyncio.Semaphore(args.concurrency)
+    reviews: List[dict] = []
+    merges: List[dict] = []
+
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout) as client:
+
+        async def review(index: int) -> None:
+            size = sizes[index % len(sizes)]
+            payload = build_pr_payload(corpus[index % len(corpus)], index, size, stub_url)
+            async with limit:
+                start_at = time.perf_counter()
+                resp = await client.post(
+                    "/webhooks/bitbucket", json=payload, headers={"X-Event-Key": "pullrequest:created"}
+                )
+                acked = time.perf_counter() - start_at
+                status = resp.json().get("status") if resp.status_code < 500 else f"http {resp.status_code}"
+                job_id = resp.json().get("job_id") if resp.status_code == 202 else None
+                while job_id:
+                    job = (await client.get(f"/jobs/{job_id}")).json()
+                    if job.get("status") in FINAL_STATUSES:
+                        status = job["status"]
+                        break
+                    await asyncio.sleep(args.poll_interval)
+                reviews.append({
+                    "size": size, "status": status, "ack": acked, "latency": time.perf_counter() - start_at,
+                })
+
+        async def merge(index: int) -> None:
+            payload = build_merge_payload(corpus[index % len(corpus)], index, stub_url)
+            async with limit:
+                start_at = time.perf_counter()
+                resp = await client.post("/webhooks/bitbucket-pr-merged", json=payload)
+                merges.append({
+                    "status": resp.json().get("status", f"http {resp.status_code}"),
+                    "latency": time.perf_counter() - start_at,
+                })
+
+        started = time.perf_counter()
+        await asyncio.gather(*[review(i) for i in range(args.prs)], *[merge(i) for i in range(args.merges)])
+        elapsed = time.perf_counter() - started
+
+    return {"elapsed": elapsed, "reviews": reviews, "merges": merges}
+
+
+def summarize(run: Dict, upstream: Dict, rss_mb: Optional[float]) -> Dict:
+    def latency_stats(rows: List[dict], key: str = "latency") -> Dict:
+        values = [row[key] for row in rows]
+        return {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+
+    by_size = {}
+    for row in run["reviews"]:
+        by_size.setdefault(str(row["size"]), []).append(row)
+    statuses: Dict[str, int] = {}
+    for row in run["reviews"] + run["merges"]:
+        statuses[row["status"]] = statuses.get(row["status"], 0) + 1
+
+    done = len(run["reviews"]) + len(run["merges"])
+    llm_calls = upstream["calls"].get("llm.chat", 0)
+    return {
+        "elapsed_seconds": run["elapsed"],
+        "throughput_per_second": done / run["elapsed"] if run["elapsed"] else 0.0,
+        "review_latency": latency_stats(run["reviews"]),
+        "review_ack_latency": latency_stats(run["reviews"], "ack"),
+        "review_latency_by_diff_bytes": {size: latency_stats(rows) for size, rows in sorted(by_size.items(), key=lambda i: int(i[0]))},
+        "merge_latency": latency_stats(run["merges"]),
+        "statuses": statuses,
+        "peak_rss_mb": rss_mb,
+        "llm_calls": llm_calls,
+        "llm_calls_per_review": llm_calls / len(run["reviews"]) if run["reviews"] else 0.0,
+        "upstream": upstream,
+    }
+
+
+def print_report(report: Dict) -> None:
+    def fmt(value, unit="s"):
+        return "-" if value is None else f"{value:.3f}{unit}"
+
+    print(f"\nelapsed {report['elapsed_seconds']:.2f}s  throughput {report['throughput_per_second']:.2f} webhooks/s")
+    print(f"{'':28}{'n':>6}{'p50':>11}{'p95':>11}{'p99':>11}")
+    rows = [("review (end to end)", report["review_latency"]), ("review ack", report["review_ack_latency"])]
+    rows += [(f"  diff {int(size) // 1024} KiB", stats) for size, stats in report["review_latency_by_diff_bytes"].items()]
+    rows.append(("merge", report["merge_latency"]))
+    for label, stats in rows:
+        print(f"{label:28}{stats['count']:>6}{fmt(stats['p50']):>11}{fmt(stats['p95']):>11}{fmt(stats['p99']):>11}")
+    print(f"statuses {report['statuses']}")
+    print(f"peak RSS {fmt(report['peak_rss_mb'], ' MiB')}  LLM calls {report['llm_calls']} "
+          f"({report['llm_calls_per_review']:.1f} per review)")
+
+
+def check_regression(report: Dict, baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    problems = []
+    if report["throughput_per_second"] < baseline["throughput_per_second"] * (1 - tolerance):
+        problems.append(
+            f"throughput {report['throughput_per_second']:.2f}/s vs baseline {baseline['throughput_per_second']:.2f}/s"
+        )
+    for key in ("review_latency", "merge_latency"):
+        now, before = report[key]["p95"], baseline.get(key, {}).get("p95")
+        if now is not None and before and now > before * (1 + tolerance):
+            problems.append(f"{key} p95 {now:.3f}s vs baseline {before:.3f}s")
+    before_calls = baseline.get("llm_calls_per_review")
+    if before_calls and report["llm_calls_per_review"] > before_calls * (1 + tolerance):
+        problems.append(f"LLM calls per review {report['llm_calls_per_review']:.1f} vs baseline {before_calls:.1f}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prs", type=int, default=20, help="pullrequest:created webhooks to replay")
+    parser.add_argument("--merges", type=int, default=0, help="pullrequest merged webhooks to replay")
+    parser.add_argument("--sizes", default="10KB,100KB,1MB,10MB", help="synthetic diff sizes, cycled (up to 100MB)")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="webhook payload JSON file or directory of them")
+    parser.add_argument("--concurrency", type=int, default=10, help="webhooks in flight at once")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--bitbucket-latency-ms", type=float, default=20)
+    parser.add_argument("--notion-latency-ms", type=float, default=50)
+    parser.add_argument("--ses-latency-ms", type=float, default=30)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app setting")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier --json report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    stub_url, app_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{app_port}"
+    state_dir = tempfile.mkdtemp(prefix="ai-reviewer-bench-")
+
+    stub_cmd = [
+        sys.executable, "-m", "benchmarks.stub_servers", "--port", str(stub_port),
+        "--llm-latency-ms", str(args.llm_latency_ms), "--bitbucket-latency-ms", str(args.bitbucket_latency_ms),
+        "--notion-latency-ms", str(args.notion_latency_ms), "--ses-latency-ms", str(args.ses_latency_ms),
+        "--llm-429-rate", str(args.llm_429_rate),
+    ]
+    app_env = dict(
+        os.environ,
+        OPENAI_API_KEY="bench", OPENAI_BASE_URL=f"{stub_url}/openai",
+        BITBUCKET_API_BASE=f"{stub_url}/bitbucket", BITBUCKET_WORKSPACE="bench",
+        BITBUCKET_USER="bench", BITBUCKET_TOKEN="bench",
+        NOTION_API_BASE=f"{stub_url}/notion", NOTION_API_KEY="bench",
+        NOTION_BACKLOG_DB_ID="bench-backlog", NOTION_TESTCASES_DB_ID="bench-testcases",
+        SES_ENDPOINT_URL=f"{stub_url}/ses", AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench",
+        STATE_DB_PATH=os.path.join(state_dir, "reviewer.db"),
+        # measure the pipeline, not the account limits
+        LLM_RPM_LIMIT="0", LLM_TPM_LIMIT="0", BITBUCKET_COMMENTS_PER_MINUTE="0",
+        JOB_QUEUE_MAXSIZE=str(max(100, args.prs)),
+    )
+    for item in args.env:
+        key, _, value = item.partition("=")
+        app_env[key] = value
+    app_cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port), "--log-level", "warning"]
+
+    app_log = os.path.join(state_dir, "app.log")
+    stub = start(stub_cmd, dict(os.environ), os.path.join(state_dir, "stub.log"))
+    app = None
+    try:
+        wait_ready(stub_url, stub)
+        app = start(app_cmd, app_env, app_log)
+        wait_ready(app_url, app)
+
+        run = asyncio.run(replay(args, app_url, stub_url, load_corpus(args.corpus)))
+        rss = peak_rss_mb(app.pid)
+        upstream = httpx.get(f"{stub_url}/_stats").json()
+    finally:
+        for proc in (app, stub):
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    report = summarize(run, upstream, rss)
+    print_report(report)
+    print(f"app log: {app_log}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        problems = check_regression(report, args.baseline, args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
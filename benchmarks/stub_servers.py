@@ -0,0 +1,292 @@
+"""
+Local stand-ins for Bitbucket, Notion, SES and an OpenAI-compatible LLM,
+served from one process with configurable latency. Used by
+benchmarks/replay.py; can also be run on its own:
+
+    python -m benchmarks.stub_servers --port 8900 --llm-latency-ms 200
+
+Point the app at it with BITBUCKET_API_BASE=http://127.0.0.1:8900/bitbucket,
+NOTION_API_BASE=.../notion, SES_ENDPOINT_URL=.../ses and
+OPENAI_BASE_URL=.../openai.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Iterator
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from app.services.llm_providers import stub_response
+
+DEFAULT_DIFF_BYTES = 20 * 1024
+NOTION_EPICS = 50
+NOTION_BLOCKS_PER_PAGE = 20
+
+app = FastAPI(title="Upstream stand-ins")
+latency = {"llm": 0.2, "bitbucket": 0.02, "notion": 0.05, "ses": 0.03}
+llm_429_rate = 0.0
+calls: Counter = Counter()
+llm_tokens = Counter()
+BOT_UUID = "{00000000-0000-0000-0000-00000000b07}"
+# (repo, pr_id) -> {comment id: comment}
+comments: dict = {}
+comment_ids = itertools.count(1)
+
+
+async def _delay(service: str, endpoint: str) -> None:
+    calls[f"{service}.{endpoint}"] += 1
+    if latency[service]:
+        await asyncio.sleep(latency[service])
+
+
+def synthetic_diff(size: int, seed: int) -> Iterator[bytes]:
+    """Deterministic unified diff of roughly `size` bytes: same seed, same diff."""
+    rng = random.Random(seed)
+    written, n = 0, 0
+    while written < size:
+        n += 1
+        path = f"src/pkg_{seed % 97}/module_{n}.py"
+        lines = [
+            f"diff --git a/{path} b/{path}\n",
+            f"index {rng.getrandbits(28):07x}..{rng.getrandbits(28):07x} 100644\n",
+            f"--- a/{path}\n",
+            f"+++ b/{path}\n",
+        ]
+        start = 1
+        for h in range(rng.randint(1, 4)):
+            start += rng.randint(5, 200)
+            body, old, new = [], 0, 0
+            for i in range(rng.randint(6, 40)):
+                name = f"value_{rng.randint(0, 9999)}"
+                kind = rng.random()
+                if kind < 0.3:
+                    body.append(f"+    {name} = compute_{seed}_{n}_{i}({name}, retries={rng.randint(1, 5)})\n")
+                    new += 1
+                elif kind < 0.45:
+                    body.append(f"-    {name} = legacy_compute({name})\n")
+                    old += 1
+                else:
+                    body.append(f"     if {name} is None:  # unchanged context {i}\n")
+                    old += 1
+                    new += 1
+            lines.append(f"@@ -{start},{old} +{start},{new} @@ def handler_{h}(request):\n")
+            lines.extend(body)
+        block = "".join(lines).encode("utf-8")
+        written += len(block)
+        yield block
+
+
+def _stream(size: int, seed: int) -> StreamingResponse:
+    return StreamingResponse(synthetic_diff(size, seed), media_type="text/plain; charset=utf-8")
+
+
+# --- Bitbucket ---
+
+@app.get("/bitbucket/repositories/{workspace}/{repo}/pullrequests/{pr_id}/diff")
+async def pr_diff(workspace: str, repo: str, pr_id: int, size: int = DEFAULT_DIFF_BYTES, seed: int = 0):
+    await _delay("bitbucket", "diff")
+    return _stream(size, seed or pr_id)
+
+
+@app.get("/bitbucket/repositories/{workspace}/{repo}/diff/{spec}")
+async def commit_diff(workspace: str, repo: str, spec: str):
+    await _delay("bitbucket", "interdiff")
+    return _stream(DEFAULT_DIFF_BYTES // 4, int(hashlib.sha1(spec.encode()).hexdigest()[:8], 16))
+
+
+@app.get("/bitbucket/user")
+async def bitbucket_user():
+    await _delay("bitbucket", "user")
+    return {"uuid": BOT_UUID, "display_name": "AI Reviewer"}
+
+
+@app.post("/bitbucket/repositories/{workspace}/{repo}/pullrequests/{pr_id}/comments")
+async def pr_comment(workspace: str, repo: str, pr_id: int, request: Request):
+    body = await request.json()
+    await _delay("bitbucket", "comment")
+    comment = {
+        "id": next(comment_ids),
+        "type": "pullrequest_comment",
+        "user": {"uuid": BOT_UUID},
+        "content": {"raw": (body.get("content") or {}).get("raw", "")},
+        "deleted": False,
+    }
+    if body.get("inline"):
+        comment["inline"] = body["inline"]
+    comments.setdefault((repo, pr_id), {})[comment["id"]] = comment
+    return JSONResponse(comment, status_code=201)
+
+
+@app.get("/bitbucket/repositories/{workspace}/{repo}/pullrequests/{pr_id}/comments")
+async def pr_comments(workspace: str, repo: str, pr_id: int, request: Request, page: int = 1, pagelen: int = 10):
+    await _delay("bitbucket", "comments_list")
+    values = list(comments.get((repo, pr_id), {}).values())
+    start = (page - 1) * pagelen
+    data = {"values": values[start:start + pagelen], "page": page, "pagelen": pagelen, "size": len(values)}
+    if start + pagelen < len(values):
+        data["next"] = str(request.url.include_query_params(page=page + 1))
+    return data
+
+
+@app.put("/bitbucket/repositories/{workspace}/{repo}/pullrequests/{pr_id}/comments/{comment_id}")
+async def pr_comment_update(workspace: str, repo: str, pr_id: int, comment_id: int, request: Request):
+    body = await request.json()
+    await _delay("bitbucket", "comment_update")
+    comment = comments.get((repo, pr_id), {}).get(comment_id)
+    if comment is None:
+        return JSONResponse({"type": "error", "error": {"message": "No Comment matches the given query."}}, status_code=404)
+    comment["content"] = {"raw": (body.get("content") or {}).get("raw", "")}
+    return comment
+
+
+# --- Notion ---
+
+def _epic_row(number: int) -> dict:
+    return {
+        "object": "page",
+        "id": f"epic-page-{number}",
+        "last_edited_time": "2024-01-01T00:00:00.000Z",
+        "properties": {"04": {"type": "unique_id", "unique_id": {"prefix": "EPIC", "number": number}}},
+    }
+
+
+@app.post("/notion/databases/{database_id}/query")
+async def notion_query(database_id: str, request: Request):
+    body = await request.json() if await request.body() else {}
+    await _delay("notion", "query")
+    filter_ = body.get("filter") or {}
+    wanted = (filter_.get("unique_id") or {}).get("equals")
+    if wanted is not None:
+        return {"object": "list", "results": [_epic_row(int(wanted))], "has_more": False, "next_cursor": None}
+    edited_after = (filter_.get("last_edited_time") or {}).get("on_or_after")
+    if edited_after and edited_after > _epic_row(1)["last_edited_time"]:
+        # stand-in epics are never edited
+        return {"object": "list", "results": [], "has_more": False, "next_cursor": None}
+    start = int(body.get("start_cursor") or 1)
+    end = min(NOTION_EPICS + 1, start + int(body.get("page_size") or 100))
+    has_more = end <= NOTION_EPICS
+    return {
+        "object": "list",
+        "results": [_epic_row(n) for n in range(start, end)],
+        "has_more": has_more,
+        "next_cursor": str(end) if has_more else None,
+    }
+
+
+@app.get("/notion/blocks/{block_id}/children")
+async def notion_children(block_id: str):
+    await _delay("notion", "blocks")
+    nested = block_id.count("-child-")
+    results = []
+    for i in range(NOTION_BLOCKS_PER_PAGE if not nested else 3):
+        results.append({
+            "object": "block",
+            "id": f"{block_id}-child-{i}",
+            "type": "paragraph",
+            # a few top-level blocks have one level of children
+            "has_children": not nested and i % 5 == 0,
+            "last_edited_time": "2024-01-01T00:00:00.000Z",
+            "paragraph": {"rich_text": [{"plain_text": f"Requirement {i} of {block_id}: the system shall handle case {i}."}]},
+        })
+    return {"object": "list", "results": results, "has_more": False, "next_cursor": None}
+
+
+@app.post("/notion/pages")
+async def notion_create_page(request: Request):
+    await request.body()
+    await _delay("notion", "create_page")
+    return {"object": "page", "id": str(uuid.uuid4())}
+
+
+# --- SES (query protocol) ---
+
+@app.post("/ses")
+@app.post("/ses/")
+async def ses(request: Request):
+    await request.body()
+    await _delay("ses", "send")
+    xml = (
+        '<SendRawEmailResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/">'
+        f"<SendRawEmailResult><MessageId>{uuid.uuid4()}</MessageId></SendRawEmailResult>"
+        f"<ResponseMetadata><RequestId>{uuid.uuid4()}</RequestId></ResponseMetadata>"
+        "</SendRawEmailResponse>"
+    )
+    return Response(content=xml, media_type="text/xml")
+
+
+# --- OpenAI-compatible chat completions ---
+
+@app.post("/openai/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await _delay("llm", "chat")
+    if llm_429_rate and random.random() < llm_429_rate:
+        calls["llm.rate_limited"] += 1
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": "1"},
+        )
+    prompt = body["messages"][-1]["content"]
+    content = json.dumps(stub_response(prompt))
+    prompt_tokens = sum(len(m.get("content", "")) for m in body["messages"]) // 4
+    completion_tokens = len(content) // 4
+    llm_tokens["prompt"] += prompt_tokens
+    llm_tokens["completion"] += completion_tokens
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+# --- control ---
+
+@app.get("/_stats")
+def stats():
+    return {"calls": dict(calls), "llm_tokens": dict(llm_tokens)}
+
+
+@app.post("/_reset")
+def reset():
+    calls.clear()
+    llm_tokens.clear()
+    comments.clear()
+    return {"status": "ok"}
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+
+def main() -> None:
+    global llm_429_rate
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    for service, default in latency.items():
+        parser.add_argument(f"--{service}-latency-ms", type=float, default=default * 1000)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="share of LLM calls answered with 429")
+    args = parser.parse_args()
+    for service in latency:
+        latency[service] = getattr(args, f"{service}_latency_ms") / 1000.0
+    llm_429_rate = args.llm_429_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()